@@ -18,12 +18,13 @@ if _i not in sys.path:
     # add parent directory to sys.path so utils module is accessible
     sys.path.insert(0, _i)
 del _i  # clean up global name space
-from shared_code.utils import (
-    check_similarity, refresh_ngrams,
-    make_ngrams, locate_potential_duplicate,
-    distance, insert_services, get_mongo_client
-)
+from shared_code.utils import insert_services, get_mongo_client
 from shared_code.base_scraper import BaseScraper
+from shared_code.membership import ValueHashSet
+from shared_code.dedup import (
+    check_service_duplicates, check_cross_source_duplicates, enrich_services,
+    drop_intra_batch_duplicates, validate_dedup_options
+)
 
 logger = logging.getLogger(__name__)
 
@@ -134,9 +135,13 @@ def prevent_IRS_EIN_duplicates(EIN, client, collection):
     return dupe
 
 
-def purge_EIN_duplicates(df, client, collection, dupe_collection):
+def purge_EIN_duplicates(df, client, collection, dupe_collection, prefilter=None):
     found_duplicates = []
+    # EINs the membership set rejects are definitely not in the collection
+    possible = prefilter.might_contain(df['EIN']) if prefilter is not None else [True] * len(df)
     for i in range(len(df)):
+        if not possible[i]:
+            continue
         EIN = int(df.loc[i, 'EIN'])
         if prevent_IRS_EIN_duplicates(EIN, client, collection):
             found_duplicates.append(i)
@@ -146,7 +151,19 @@ def purge_EIN_duplicates(df, client, collection, dupe_collection):
     df = df.drop(found_duplicates).reset_index(drop=True)
     return df
 
-def main(config, client, check_collection, dump_collection, dupe_collection):
+def update_prefilter(prefilter, df, client):
+    if prefilter is not None:
+        prefilter.add(df['EIN'])
+        prefilter.save(client)
+
+def main(config, client, check_collection, dump_collection, dupe_collection,
+         dedup_index=None, enrich=False, decision_cache=False, workers=None, top_k=None,
+         intra_batch=False, cross_source=False, explain=False, dupe_prefilter=False,
+         key_match=False):
+    validate_dedup_options(
+        dedup_index, decision_cache, workers, top_k, explain, key_match, cross_source
+    )
+    enrich_hook = enrich_services if enrich else None
     scraped_update_date = scrape_updated_date()
     try:
         stored_update_date = retrieve_last_scraped_date(date)
@@ -163,25 +180,33 @@ def main(config, client, check_collection, dump_collection, dupe_collection):
     )
     code_dict = config['NTEE_codes']
     df = grab_data(config, code_dict)
+    prefilter = ValueHashSet.load(client, dump_collection, 'EIN') if dupe_prefilter else None
     logger.info('purging EIN duplicates')
     if client[dump_collection].estimated_document_count() > 0:
-        df = purge_EIN_duplicates(df, client, dump_collection, dupe_collection)
-    if client[check_collection].estimated_document_count() == 0:
+        df = purge_EIN_duplicates(df, client, dump_collection, dupe_collection, prefilter)
+    if intra_batch:
+        df, batch_duplicates = drop_intra_batch_duplicates(df)
+        if len(batch_duplicates) > 0:
+            insert_services(batch_duplicates.to_dict('records'), client, dupe_collection)
+    if client[check_collection].estimated_document_count() == 0 and not cross_source:
         # No need to check for duplicates in an empty collection
-        insert_services(df.to_dict('records'), client, dump_collection)
+        insert_services(df.to_dict('records'), client, dump_collection, enrich_hook)
+        update_prefilter(prefilter, df, client)
     else:
-        logger.info('refreshing ngrams')
-        refresh_ngrams(client, check_collection)
-        found_duplicates = []
-        logger.info('checking for duplicates in the services collection')
-        for i in tqdm(range(len(df))):
-            dc = locate_potential_duplicate(
-                df.loc[i, 'name'], df.loc[i, 'zip'], client, check_collection
+        if cross_source:
+            matched = check_cross_source_duplicates(
+                df, client, check_collection, exclude=[dump_collection]
+            )
+            found_duplicates = sorted(matched)
+            duplicate_df = df.loc[found_duplicates].assign(
+                duplicate_collection=[matched[i] for i in found_duplicates]
+            ).reset_index(drop=True)
+        else:
+            found_duplicates = check_service_duplicates(
+                df, client, check_collection, dedup_index, decision_cache, workers, top_k, explain,
+                key_match
             )
-            if dc is not False:
-                if check_similarity(df.loc[i, 'name'], dc):
-                    found_duplicates.append(i)
-        duplicate_df = df.loc[found_duplicates].reset_index(drop=True)
+            duplicate_df = df.loc[found_duplicates].reset_index(drop=True)
         logger.info(
             f'inserting {duplicate_df.shape[0]} services dupes into the dupe collection'
         )
@@ -190,7 +215,8 @@ def main(config, client, check_collection, dump_collection, dupe_collection):
         df = df.drop(found_duplicates).reset_index(drop=True)
         logger.info(f'final df shape: {df.shape}')
         if len(df) > 0:
-            insert_services(df.to_dict('records'), client, dump_collection)
+            insert_services(df.to_dict('records'), client, dump_collection, enrich_hook)
+            update_prefilter(prefilter, df, client)
 
 if __name__ == "__main__":
     client = get_mongo_client()
@@ -8,6 +8,12 @@ Run this script as follows
 
 python fuzzy_matching.py "OREGON FOOD BANK, INC." "97211" "services"
 
+To check many entries at once, pass a CSV or JSONL file of name and zip
+pairs in batch mode. The decisions, scores and matched _ids are written to
+the output file, CSV or JSONL by its extension, and a throughput summary
+is printed. --workers scores the zip groups in that many processes.
+
+python fuzzy_matching.py --batch "rows.csv" "decisions.csv" "services" --workers=4
 
 """
 
@@ -16,12 +22,52 @@ if _i not in sys.path:
     # add parent directory to sys.path so utils module is accessible
     sys.path.insert(0, _i)
 del _i  # clean up global name space
+import time
+import pandas as pd
 from shared_code.utils import (
-    check_similarity, locate_potential_duplicate, get_mongo_client, distance
+    locate_potential_duplicate, get_mongo_client, distance
 )
+from shared_code.dedup import resolve_service_matches
+
+
+def read_rows(path):
+    if path.endswith('.jsonl'):
+        return pd.read_json(path, lines=True, dtype={'zip': str})
+    return pd.read_csv(path, dtype={'zip': str})
+
+
+def write_decisions(decisions, path):
+    if path.endswith('.jsonl'):
+        decisions.to_json(path, orient='records', lines=True)
+    else:
+        decisions.to_csv(path, index=False)
+
+
+def batch(client, args):
+    options = dict(a[2:].split('=', 1) for a in args if a.startswith('--') and '=' in a)
+    paths = [a for a in args if not a.startswith('--')]
+    if len(paths) < 2:
+        print('Batch mode requires an input and an output file, received ' + str(len(paths)))
+        return
+    check_collection = paths[2] if len(paths) >= 3 else 'services'
+    workers = int(options['workers']) if 'workers' in options else None
+
+    rows = read_rows(paths[0])
+    start = time.perf_counter()
+    decisions = resolve_service_matches(rows, client, check_collection, workers)
+    elapsed = time.perf_counter() - start
+    write_decisions(decisions, paths[1])
+    print('Resolved ' + str(len(decisions)) + ' rows against `' + check_collection + '` in '
+          + f'{elapsed:.1f}s ({len(decisions) / max(elapsed, 1e-9):,.0f} rows/s), '
+          + str(int(decisions['duplicate'].sum())) + ' duplicates.')
+    print('Decisions written to ' + paths[1])
+
 
 if __name__ == "__main__":
     client = get_mongo_client()
+    if '--batch' in sys.argv:
+        batch(client, [a for a in sys.argv[1:] if a != '--batch'])
+        sys.exit(0)
     if len(sys.argv) < 3:
         print('Fewer than required arguments received. Required 3, Received ' + len(sys.argv))
 
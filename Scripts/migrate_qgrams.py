@@ -0,0 +1,41 @@
+import sys
+import os
+
+"""
+This script migrates a collection from the ngrams field to the compact qgrams field.
+Run this script as follows
+
+python migrate_qgrams.py "services" [--drop-ngrams]
+
+With --drop-ngrams the ngrams and ngrams_hash fields and the ngrams_text index
+are removed once every document has qgrams. Only do this after all scrapers have been
+switched to dedup_index='qgram', since the default dedup path still
+searches the ngrams text index.
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+from shared_code.utils import get_mongo_client, refresh_qgrams
+
+if __name__ == "__main__":
+    client = get_mongo_client()
+    args = [a for a in sys.argv[1:] if a != '--drop-ngrams']
+    collection = args[0] if len(args) >= 1 else 'services'
+
+    updated = refresh_qgrams(client, collection)
+    print('Updated qgrams of ' + str(updated) + ' documents in `' + collection + '`.')
+
+    if '--drop-ngrams' in sys.argv:
+        coll = client[collection]
+        if 'ngrams_text' in coll.index_information().keys():
+            coll.drop_index('ngrams_text')
+        # refresh_ngrams skips documents whose ngrams_hash matches, so it must go too
+        result = coll.update_many(
+            {'$or': [{'ngrams': {'$exists': True}}, {'ngrams_hash': {'$exists': True}}]},
+            {'$unset': {'ngrams': '', 'ngrams_hash': ''}}
+        )
+        print('Removed ngrams from ' + str(result.modified_count) + ' documents.')
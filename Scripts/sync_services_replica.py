@@ -0,0 +1,32 @@
+import sys
+import os
+
+"""
+This script mirrors the services collection into the local SQLite FTS5
+replica used by the 'sqlite' dedup index. Run this script as follows
+
+python sync_services_replica.py "/path/to/services_replica.sqlite3" "services" [--full]
+
+Both arguments are optional, the path defaults to SERVICES_REPLICA_PATH or a
+file in the temp directory. Without --full only new and updated documents are copied.
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+from shared_code.utils import get_mongo_client
+from shared_code.sqlite_replica import ServicesReplica, DEFAULT_REPLICA_PATH
+
+if __name__ == "__main__":
+    client = get_mongo_client()
+    args = [a for a in sys.argv[1:] if a != '--full']
+    path = args[0] if len(args) >= 1 else os.environ.get('SERVICES_REPLICA_PATH', DEFAULT_REPLICA_PATH)
+    collection = args[1] if len(args) >= 2 else 'services'
+
+    replica = ServicesReplica(path)
+    copied = replica.sync(client, collection, full='--full' in sys.argv)
+    print('Copied ' + str(copied) + ' documents, replica now holds ' + str(len(replica)) + ' services.')
+    replica.close()
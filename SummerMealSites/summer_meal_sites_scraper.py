@@ -32,12 +32,15 @@ class SummerMealSitesScraper(BaseScraper):
         new_data = []
         for item in data:
             if item['properties']:
-                new_data.append(item['properties'])
+                #keep the point coordinates for geo dedup
+                geometry = item.get('geometry') or {}
+                lon, lat = (geometry.get('coordinates') or [None, None])[:2]
+                new_data.append(dict(item['properties'], lat=lat, lon=lon))
         df = pd.DataFrame(new_data)
 
         #Extract useful cols
         df = df[['siteName', 'siteStatus','siteAddress','siteCity',
-        'siteState','siteZip','sitePhone','Country']]
+        'siteState','siteZip','sitePhone','Country','lat','lon']]
 
         #Removing schools, and non-homeless related resources
         ignore_resources_with_keywords = ['school', 'middle', 'elementary', 'high', 'academy','Academy',
@@ -0,0 +1,39 @@
+import os
+import sys
+import timeit
+
+"""
+Micro-benchmark comparing the NumPy one-vs-many shared_code.utils.batch_distance
+with calling the scalar distance() once per candidate.
+Run this script as follows
+
+python benchmarks/batch_distance_benchmark.py 10000
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+import numpy as np
+from shared_code.utils import distance, batch_distance
+from benchmarks.distance_benchmark import make_pairs, SERVICE_NAMES
+
+
+def run(func, repeat=5):
+    return min(timeit.Timer(func).repeat(repeat=repeat, number=1))
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    candidates = [b for _, b in make_pairs(size)]
+    for name in (SERVICE_NAMES[0].lower(), SERVICE_NAMES[-1].lower()):
+        expected = np.array([distance(name, c) for c in candidates])
+        assert np.allclose(batch_distance(name, candidates), expected)
+        scalar = run(lambda: [distance(name, c) for c in candidates])
+        batch = run(lambda: batch_distance(name, candidates))
+        print(f'{name!r} vs {size} candidates')
+        print(f'  scalar distance(): {scalar:.3f}s ({size / scalar:,.0f} pairs/s)')
+        print(f'  batch_distance():  {batch:.3f}s ({size / batch:,.0f} pairs/s)')
+        print(f'  speedup: {scalar / batch:.1f}x')
@@ -0,0 +1,103 @@
+import random
+
+"""
+Synthetic service-name corpus shared by the dedup benchmarks. Names are built
+from the vocabulary of the scraped sources, with the Saint/St./Inc/NFP variants
+and typos that the dedup stage has to see through, and zips are drawn from a
+fixed pool so that zip groups have realistic sizes.
+
+"""
+
+PREFIXES = ['ST ', 'ST. ', 'SAINT ', '']
+SAINTS = ['FERIOLE', 'VINCENT DE PAUL', 'MARYS', 'DOMINICS', 'JOSEPHS', 'FRANCIS', 'ANTHONYS']
+PLACES = [
+    'PORTLAND', 'CHICAGO', 'BALTIMORE', 'HOUSTON', 'OAKLAND', 'SEATTLE', 'ST LOUIS',
+    'LAKE HOPE', 'HARRIS COUNTY', 'SAN FRANCISCO', 'WASHINGTON', 'PITTSBURGH',
+]
+WORDS = [
+    'FOOD', 'BANK', 'PANTRY', 'SHELTER', 'HOUSE', 'MISSION', 'COMMUNITY',
+    'CENTER', 'FAMILY', 'SERVICES', 'LEGAL', 'AID', 'HOPE', 'CHARITIES',
+    'COALITION', 'HOMELESS', 'YOUTH', 'VETERANS', 'CLINIC', 'OUTREACH',
+]
+CONNECTORS = ['OF', 'FOR', 'AND', 'THE']
+SUFFIXES = [' INC', ' INC.', ', INC.', ' NFP', '']
+
+
+def _base_name(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.3:
+        return rng.choice(PREFIXES) + rng.choice(SAINTS) + ' ' + ' '.join(words)
+    if rng.random() < 0.5:
+        return ' '.join(words) + f' {rng.choice(CONNECTORS)} ' + rng.choice(PLACES)
+    return rng.choice(PLACES) + ' ' + ' '.join(words)
+
+
+def typo(name, rng):
+    """Apply one random substitution, deletion, insertion or transposition."""
+    if len(name) < 2:
+        return name
+    i = rng.randrange(len(name) - 1)
+    letter = rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + letter + name[i + 1:]
+    if kind == 1:
+        return name[:i] + name[i + 1:]
+    if kind == 2:
+        return name[:i] + letter + name[i:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def variant(name, rng):
+    """A near-duplicate spelling of name: swapped saint/inc forms and maybe a typo."""
+    for prefix in PREFIXES[:-1]:
+        if name.startswith(prefix):
+            name = rng.choice(PREFIXES[:-1]) + name[len(prefix):]
+            break
+    for suffix in SUFFIXES[:-1]:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    name += rng.choice(SUFFIXES)
+    if rng.random() < 0.5:
+        name = typo(name, rng)
+    return name
+
+
+def zip_pool(count, rng):
+    return [f'{z:05d}' for z in rng.sample(range(1000, 99999), min(count, 98999))]
+
+
+def synthetic_services(count, zips, rng):
+    """count service documents with a name and a zip drawn from zips."""
+    return [
+        {'name': _base_name(rng) + rng.choice(SUFFIXES), 'zip': rng.choice(zips)}
+        for _ in range(count)
+    ]
+
+
+def incoming_rows(services, count, rng, duplicate_rate=0.3):
+    """Rows of a scraped batch: variants of existing services at duplicate_rate,
+       and new services in the same zips otherwise.
+    """
+    zips = sorted({s['zip'] for s in services})
+    rows = []
+    for _ in range(count):
+        if rng.random() < duplicate_rate:
+            service = rng.choice(services)
+            rows.append({'name': variant(service['name'], rng), 'zip': service['zip']})
+        else:
+            rows.append({'name': _base_name(rng) + rng.choice(SUFFIXES), 'zip': rng.choice(zips)})
+    return rows
+
+
+def corpus(services_count, rows_count, seed=0, zip_count=None, duplicate_rate=0.3):
+    """Services for the check collection and incoming rows to check against them.
+
+    Returns:
+        tuple: (services, rows), lists of {'name', 'zip'} dicts
+    """
+    rng = random.Random(seed)
+    zips = zip_pool(zip_count or max(10, services_count // 25), rng)
+    services = synthetic_services(services_count, zips, rng)
+    return services, incoming_rows(services, rows_count, rng, duplicate_rate)
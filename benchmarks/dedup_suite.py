@@ -0,0 +1,136 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+"""
+Benchmark suite of the dedup hot path on a synthetic corpus (see corpus.py):
+make_ngrams, distance and check_similarity per call, and
+locate_potential_duplicate for every dedup engine. For each it reports
+throughput, p50/p95/p99 latency and the peak traced memory, which covers
+the calls for the functions and building the index for the engines.
+Run this script as follows
+
+python benchmarks/dedup_suite.py 1000 10000 100000 1000000 --rows=2000 --mongo=mongodb://localhost:27017
+
+The positional arguments are the sizes of the synthetic services collection,
+1000 and 10000 by default. --rows is the number of incoming rows checked per
+size, 2000 by default. Without --mongo the collection lives in mongomock and
+the MongoDB $text engine is skipped, with it a scratch collection is created
+in the given mongod and dropped afterwards. --engines=ngram,zip limits the
+engines that are run.
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+import mongomock
+import numpy as np
+from pymongo import MongoClient
+from shared_code.utils import (
+    make_ngrams, distance, check_similarity, locate_potential_duplicate, refresh_ngrams
+)
+from shared_code.dedup import DEDUP_INDEXES, build_dedup_index
+from corpus import corpus
+
+SCRATCH_COLLECTION = 'benchmarkDedupServices'
+
+
+def latencies(fn, calls):
+    """Per-call latency of fn over a list of argument tuples, in microseconds."""
+    timings = np.empty(len(calls))
+    for i, args in enumerate(calls):
+        start = time.perf_counter_ns()
+        fn(*args)
+        timings[i] = (time.perf_counter_ns() - start) / 1000
+    return timings
+
+
+def peak_memory(fn):
+    """Peak memory traced while running fn, in MB."""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def report(label, timings, peak):
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    throughput = len(timings) / (timings.sum() / 1e6)
+    print(f'{label:<28}{len(timings):>9}{throughput:>14,.0f}{p50:>10.1f}{p95:>10.1f}'
+          f'{p99:>10.1f}{peak:>10.1f}')
+
+
+def bench_functions(services, rows):
+    pairs = [(r['name'], s['name']) for r, s in zip(rows, services)]
+    calls = {
+        'make_ngrams': (make_ngrams, [(r['name'],) for r in rows]),
+        'distance': (distance, pairs),
+        'check_similarity': (check_similarity, pairs),
+    }
+    for label, (fn, args) in calls.items():
+        timings = latencies(fn, args)
+        peak = peak_memory(lambda: latencies(fn, args))
+        report(label, timings, peak)
+
+
+def bench_engines(db, rows, engines):
+    # a fresh SQLite replica per corpus, the default one persists across runs
+    os.environ['SERVICES_REPLICA_PATH'] = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+    for kind in engines:
+        index = None
+
+        def build():
+            nonlocal index
+            if kind is None:
+                refresh_ngrams(db, SCRATCH_COLLECTION)
+                return
+            index = build_dedup_index(kind, db, SCRATCH_COLLECTION)
+            if hasattr(index, 'prefetch'):
+                index.prefetch({r['zip'] for r in rows})
+
+        peak = peak_memory(build)
+        timings = latencies(
+            lambda name, zipcode: locate_potential_duplicate(
+                name, zipcode, db, SCRATCH_COLLECTION, index
+            ),
+            [(r['name'], r['zip']) for r in rows]
+        )
+        if hasattr(index, 'close'):
+            index.close()
+        report(f'locate[{kind or "mongo-text"}]', timings, peak)
+
+
+if __name__ == "__main__":
+    options = dict(a[2:].split('=', 1) for a in sys.argv[1:] if a.startswith('--'))
+    sizes = [int(a) for a in sys.argv[1:] if not a.startswith('--')] or [1000, 10000]
+    row_count = int(options.get('rows', 2000))
+    if 'mongo' in options:
+        db = MongoClient(options['mongo']).shelter
+        engines = [None] + list(DEDUP_INDEXES)
+    else:
+        db = mongomock.MongoClient().shelter
+        engines = list(DEDUP_INDEXES)
+    if 'engines' in options:
+        engines = [None if e == 'mongo-text' else e for e in options['engines'].split(',')]
+
+    for size in sizes:
+        services, rows = corpus(size, row_count, seed=size)
+        db.drop_collection(SCRATCH_COLLECTION)
+        for start in range(0, len(services), 10000):
+            db[SCRATCH_COLLECTION].insert_many([dict(s) for s in services[start:start + 10000]])
+        print(f'\n{size:,} services, {len(rows):,} incoming rows, '
+              f'e.g. {random.Random(size).choice(rows)["name"]!r}')
+        print(f'{"":<28}{"calls":>9}{"calls/s":>14}{"p50 us":>10}{"p95 us":>10}'
+              f'{"p99 us":>10}{"peak MB":>10}')
+        bench_functions(services, rows)
+        bench_engines(db, rows, engines)
+        db.drop_collection(SCRATCH_COLLECTION)
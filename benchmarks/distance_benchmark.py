@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+import timeit
+
+"""
+Micro-benchmark comparing the bit-parallel Levenshtein engine behind
+shared_code.utils.distance and the threshold-bounded bounded_distance
+with the previous row-by-row implementation.
+Run this script as follows
+
+python benchmarks/distance_benchmark.py
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+from shared_code.utils import distance, bounded_distance
+
+SERVICE_NAMES = [
+    'OREGON FOOD BANK, INC.',
+    'ST FERIOLE ISLAND PARK',
+    'SAINT DOMINICS LEGAL DEFENSE FUND',
+    'FRIENDS OF LAKE HOPE',
+    'FIRST DEFENSE LEGAL AID',
+    'SALVATION ARMY FAMILY SERVICES CENTER',
+    'NORTHWEST HOSPITALITY HOUSE',
+    'COALITION FOR THE HOMELESS OF HOUSTON HARRIS COUNTY',
+    'CATHOLIC CHARITIES OF THE ARCHDIOCESE OF SAN FRANCISCO',
+    'GREATER BALTIMORE URBAN LEAGUE INCORPORATED NFP',
+]
+
+
+def legacy_distance(a, b):
+    """ The previous O(n*m) implementation of shared_code.utils.distance.
+    """
+    n, m = len(a), len(b)
+    if n > m:
+        a, b = b, a
+        n, m = m, n
+
+    current = range(n + 1)
+    for i in range(1, m + 1):
+        previous, current = current, [i] + [0] * n
+        for j in range(1, n + 1):
+            add, delete = previous[j] + 1, current[j - 1] + 1
+            change = previous[j - 1]
+            if a[j - 1] != b[i - 1]:
+                change = change + 1
+            current[j] = min(add, delete, change)
+
+    return 1 - (current[n] / len(a))
+
+
+def make_pairs(count, seed=0):
+    """Build (new, existing) pairs from real service names, half of them
+       near-duplicates with a single typo and half unrelated names.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(count):
+        name = rng.choice(SERVICE_NAMES).lower()
+        if i % 2 == 0:
+            pos = rng.randrange(len(name))
+            other = name[:pos] + rng.choice('abcdefghijklmnopqrstuvwxyz') + name[pos + 1:]
+        else:
+            other = rng.choice(SERVICE_NAMES).lower()
+        pairs.append((name, other))
+    return pairs
+
+
+def run(pairs, func, repeat=5):
+    timer = timeit.Timer(lambda: [func(a, b) for a, b in pairs])
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == "__main__":
+    pairs = make_pairs(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+    assert all(distance(a, b) == legacy_distance(a, b) for a, b in pairs)
+    legacy = run(pairs, legacy_distance)
+    current = run(pairs, distance)
+    bounded = run(pairs, bounded_distance)
+    print(f'{len(pairs)} pairs')
+    print(f'legacy row-by-row: {legacy:.3f}s ({len(pairs) / legacy:,.0f} pairs/s)')
+    print(f'bit-parallel:      {current:.3f}s ({len(pairs) / current:,.0f} pairs/s)')
+    print(f'bounded (>= 0.9):  {bounded:.3f}s ({len(pairs) / bounded:,.0f} pairs/s)')
+    print(f'speedup: {legacy / current:.1f}x bit-parallel, {legacy / bounded:.1f}x bounded')
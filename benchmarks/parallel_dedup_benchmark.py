@@ -0,0 +1,68 @@
+import os
+import random
+import sys
+import time
+
+"""
+Worker-count scaling benchmark of the process-pool dedup mode against
+resolving the same rows sequentially in-process, on synthetic services.
+The shared-memory candidate store is built once up front, so the timings
+cover candidate resolution and scoring only, not MongoDB access.
+Run this script as follows
+
+python benchmarks/parallel_dedup_benchmark.py 10000 100000
+
+The arguments are the incoming row counts to benchmark, the check
+collection holds 50,000 synthetic services spread over 2,000 zips.
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+import mongomock
+import pandas as pd
+from shared_code.utils import check_similarity
+from shared_code.parallel_dedup import SharedCandidateStore, find_service_duplicates_parallel
+
+WORDS = [
+    'FOOD', 'BANK', 'PANTRY', 'SHELTER', 'HOUSE', 'MISSION', 'COMMUNITY',
+    'CENTER', 'FAMILY', 'SERVICES', 'LEGAL', 'AID', 'HOPE', 'CHARITIES',
+    'COALITION', 'HOMELESS', 'YOUTH', 'VETERANS', 'CLINIC', 'OUTREACH',
+]
+
+
+def synthetic_services(count, zips, rng):
+    return [
+        {'name': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))),
+         'zip': rng.choice(zips)}
+        for _ in range(count)
+    ]
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    zips = [f'{z:05d}' for z in rng.sample(range(1000, 99999), 2000)]
+    client = mongomock.MongoClient().shelter
+    client.services.insert_many(synthetic_services(50000, zips, rng))
+    store = SharedCandidateStore.from_collection(client, 'services')
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000]
+    try:
+        for size in sizes:
+            df = pd.DataFrame(synthetic_services(size, zips, rng))
+            start = time.perf_counter()
+            for name, zipcode in zip(df['name'], df['zip']):
+                dc = store.locate_potential_duplicate(name, zipcode)
+                dc is not False and check_similarity(name, dc)
+            sequential = time.perf_counter() - start
+            print(f'{size} rows, sequential: {sequential:.1f}s ({size / sequential:,.0f} rows/s)')
+            for workers in (1, 2, 4, 8):
+                start = time.perf_counter()
+                find_service_duplicates_parallel(df, None, None, workers, store=store)
+                elapsed = time.perf_counter() - start
+                print(f'{size} rows, {workers} workers: {elapsed:.1f}s '
+                      f'({sequential / elapsed:.1f}x, {size / elapsed:,.0f} rows/s)')
+    finally:
+        store.close(unlink=True)
@@ -0,0 +1,78 @@
+import os
+import statistics
+import sys
+import time
+
+"""
+Benchmark of the ngrams $text representation against the compact qgrams
+representation: document size, index size and per-row query latency.
+It needs a real MongoDB (mongomock has no $text or collStats). Run this script as follows
+
+python benchmarks/qgram_benchmark.py "mongodb://localhost:27017" 5000
+
+A sample of the services collection is copied into two scratch collections,
+which are dropped afterwards.
+
+"""
+
+_i = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _i not in sys.path:
+    # add parent directory to sys.path so utils module is accessible
+    sys.path.insert(0, _i)
+del _i  # clean up global name space
+from shared_code.utils import (
+    get_mongo_client, refresh_ngrams, refresh_qgrams, locate_potential_duplicate
+)
+from shared_code.dedup import QgramIndex
+
+
+def collection_sizes(client, collection):
+    stats = client.command('collstats', collection)
+    return stats['avgObjSize'], stats['indexSizes']
+
+
+def latencies(lookup, rows):
+    timings = []
+    for name, zipcode in rows:
+        start = time.perf_counter()
+        lookup(name, zipcode)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, client, collection, timings):
+    avg_obj_size, index_sizes = collection_sizes(client, collection)
+    print(label)
+    print(f'  avg document size: {avg_obj_size:,.0f} bytes')
+    for index_name, size in index_sizes.items():
+        print(f'  index {index_name}: {size / 1024:,.0f} KiB')
+    print(f'  query latency: median {statistics.median(timings) * 1000:.2f} ms, '
+          f'p95 {statistics.quantiles(timings, n=20)[-1] * 1000:.2f} ms')
+
+
+if __name__ == "__main__":
+    client = get_mongo_client(sys.argv[1] if len(sys.argv) > 1 else None)
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    sample = list(client['services'].aggregate([
+        {'$sample': {'size': size}},
+        {'$project': {'name': 1, 'zip': 1, 'city': 1, 'state': 1}}
+    ]))
+    rows = [(d['name'], d.get('zip')) for d in sample if d.get('name')][:1000]
+
+    for collection in ('bench_ngrams', 'bench_qgrams'):
+        client.drop_collection(collection)
+        client[collection].insert_many([dict(d) for d in sample])
+    try:
+        refresh_ngrams(client, 'bench_ngrams')
+        timings = latencies(
+            lambda n, z: locate_potential_duplicate(n, z, client, 'bench_ngrams'), rows
+        )
+        report('ngrams + text index', client, 'bench_ngrams', timings)
+
+        refresh_qgrams(client, 'bench_qgrams')
+        index = QgramIndex(client, 'bench_qgrams')
+        timings = latencies(index.locate_potential_duplicate, rows)
+        report('qgrams + (zip, qgrams) index', client, 'bench_qgrams', timings)
+    finally:
+        client.drop_collection('bench_ngrams')
+        client.drop_collection('bench_qgrams')
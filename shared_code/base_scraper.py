@@ -5,13 +5,14 @@ from datetime import datetime
 import requests
 import pandas as pd
 from pymongo import MongoClient, errors
-from tqdm import tqdm
 from pytz import timezone
 
-from shared_code.utils import (
-    insert_services, locate_potential_duplicate,
-    check_similarity, refresh_ngrams
+from shared_code.utils import insert_services, find_existing_values
+from shared_code.dedup import (
+    check_service_duplicates, check_cross_source_duplicates, enrich_services,
+    drop_intra_batch_duplicates, validate_dedup_options
 )
+from shared_code.membership import ValueHashSet
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -102,31 +103,48 @@ class BaseScraper:
         df['source'] = [self.source] * len(df)
         return df
 
-    def purge_collection_duplicates(self, df: pd.DataFrame, client: MongoClient) -> pd.DataFrame:
+    def purge_collection_duplicates(self, df: pd.DataFrame, client: MongoClient,
+                                    prefilter: ValueHashSet = None) -> pd.DataFrame:
         """Function to check the pre-processed data and
         delete exact dupes that already exist in the tmp collection
 
         Args:
             df (pd.DataFrame): pre-processed data from grab_data()
             client (MongoClient): MongoDB connection instance
+            prefilter (ValueHashSet, optional): membership set of the dump collection
+                field, only the values it may contain are looked up in MongoDB.
+                Defaults to None.
 
         Returns:
             pd.DataFrame: DataFrame free of exact duplicates
         """
-        found_duplicates = []
-        coll = client[self.dump_collection]
-        for i in tqdm(range(len(df))):
-            idx = df.loc[i, self.collection_dupe_field]
-            dupe = coll.find_one(
-                {self.collection_dupe_field: idx}
+        values = df[self.collection_dupe_field]
+        candidates = values
+        if prefilter is not None:
+            candidates = values[prefilter.might_contain(values)]
+            logger.info(
+                f'{len(candidates)} of {len(values)} {self.collection_dupe_field} values '
+                f'may already exist in {self.dump_collection}'
             )
-            if dupe is not None:
-                found_duplicates.append(i)
-        duplicate_df = df.loc[found_duplicates].reset_index(drop=True)
+        existing = find_existing_values(
+            client, self.dump_collection, self.collection_dupe_field, candidates.unique()
+        )
+        mask = values.isin(existing)
+        duplicate_df = df[mask].reset_index(drop=True)
         insert_services(duplicate_df.to_dict('records'), client, self.dupe_collection)
-        df = df.drop(found_duplicates).reset_index(drop=True)
+        df = df[~mask].reset_index(drop=True)
         return df
 
+    def update_prefilter(self, prefilter: ValueHashSet, df: pd.DataFrame,
+                         client: MongoClient) -> None:
+        """Add the values of rows just inserted into the dump collection to its
+        membership set and persist them, if the scraper keeps one.
+        """
+        if prefilter is None:
+            return
+        prefilter.add(df[self.collection_dupe_field])
+        prefilter.save(client)
+
     def is_new_data_available(self, client: MongoClient) -> bool:
         """
         Common routine to check if new data is available for the scraper. 
@@ -165,42 +183,100 @@ class BaseScraper:
            else:
                 raise Exception("value for field `source` can't be null or emtpy.")
 
-    def main_scraper(self, client: MongoClient) -> None:
+    def main_scraper(self, client: MongoClient, dedup_index: str = None,
+                     enrich: bool = False, decision_cache: bool = False,
+                     workers: int = None, top_k: int = None,
+                     intra_batch: bool = False, cross_source: bool = False,
+                     explain=False, dupe_prefilter: bool = False,
+                     key_match: bool = False) -> None:
         """Base function for ingesting raw data, preparing it and depositing it in MongoDB
 
         Args:
             client (MongoClient): connection to the MongoDB instance
-            scraper_config (ScraperConfig): instance of the ScraperConfig class
+            dedup_index (str, optional): in-process candidate index to check duplicates
+                against instead of MongoDB $text search, one of the keys of
+                shared_code.dedup.DEDUP_INDEXES. Defaults to None.
+            enrich (bool, optional): add the dedup fields (ngrams, qgrams, normalized
+                name, minhash) to the documents written to the dump collection, so they
+                are ready when promoted into services. Defaults to False.
+            decision_cache (bool, optional): reuse the dedup decisions of earlier runs
+                while the services collection is unchanged. Defaults to False.
+            workers (int, optional): check duplicates in this many processes against a
+                shared-memory copy of the services collection. Defaults to None.
+            top_k (int, optional): compare every row against its top_k best $text
+                matches instead of the first one found. Defaults to None.
+            intra_batch (bool, optional): move rows that fuzzy-match an earlier row of
+                the same download into the dupe collection before checking the rest
+                against the services collection. Defaults to False.
+            cross_source (bool, optional): check duplicates against the services
+                collection and the dump collections of all other scrapers in one pass,
+                recording the matched collection in the duplicate_collection field of
+                the dupes. Defaults to False.
+            explain (bool or str, optional): log per-stage statistics and histograms of
+                candidates and lookup latency for the dedup stage, a path also writes a
+                per-row JSONL trace there. Defaults to False.
+            dupe_prefilter (bool, optional): keep a persistent hash set of the
+                collection_dupe_field values of the dump collection, so that only the
+                values it may contain are looked up when purging exact dupes. Defaults
+                to False.
+            key_match (bool, optional): treat rows sharing a phone, website domain, email
+                or address with a similarly named service of the same zip as dupes before
+                the fuzzy name check. Defaults to False.
+
+        Raises:
+            ValueError: for dedup options that cannot be combined, e.g. cross_source
+                with dedup_index, see shared_code.dedup.validate_dedup_options
         """
+        validate_dedup_options(
+            dedup_index, decision_cache, workers, top_k, explain, key_match, cross_source
+        )
+        enrich_hook = enrich_services if enrich else None
         if not self.is_new_data_available(client):
             logger.info('No new data. Goodbye...')
             return
 
         df = self.grab_data()
 
+        prefilter = None
+        if dupe_prefilter:
+            prefilter = ValueHashSet.load(client, self.dump_collection, self.collection_dupe_field)
+
         if client[self.dump_collection].estimated_document_count() > 0:
             logger.info(f'purging duplicates from existing {self.source} collection')
-            df = self.purge_collection_duplicates(df, client)
+            df = self.purge_collection_duplicates(df, client, prefilter)
 
         if self.groupby_columns is not None:
             df = self.aggregate_service_summary(df)
 
-        if client[self.check_collection].estimated_document_count() == 0:
+        if intra_batch:
+            df, batch_duplicates = drop_intra_batch_duplicates(df)
+            if len(batch_duplicates) > 0:
+                logger.info(f'inserting batch dupes into the {self.source} dupe collection')
+                insert_services(
+                    batch_duplicates.to_dict('records'), client, self.dupe_collection
+                )
+
+        if client[self.check_collection].estimated_document_count() == 0 and not cross_source:
             # No need to check for duplicates in an empty collection
-            insert_services(df.to_dict('records'), client, self.dump_collection)
+            insert_services(
+                df.to_dict('records'), client, self.dump_collection, enrich_hook
+            )
+            self.update_prefilter(prefilter, df, client)
         else:
-            logger.info('refreshing ngrams')
-            refresh_ngrams(client, self.check_collection)
-            found_duplicates = []
-            logger.info('checking for duplicates in the services collection')
-            for i in tqdm(range(len(df))):
-                dc = locate_potential_duplicate(
-                    df.loc[i, 'name'], df.loc[i, 'zip'], client, self.check_collection
+            if cross_source:
+                matched = check_cross_source_duplicates(
+                    df, client, self.check_collection, exclude=[self.dump_collection]
                 )
-                if dc is not False:
-                    if check_similarity(df.loc[i, 'name'], dc):
-                        found_duplicates.append(i)
-            duplicate_df = df.loc[found_duplicates].reset_index(drop=True)
+                found_duplicates = sorted(matched)
+                duplicate_df = df.loc[found_duplicates].assign(
+                    duplicate_collection=[matched[i] for i in found_duplicates]
+                ).reset_index(drop=True)
+            else:
+                found_duplicates = check_service_duplicates(
+                    df, client, self.check_collection, dedup_index, decision_cache, workers,
+                    top_k, explain, key_match
+                )
+                duplicate_df = df.loc[found_duplicates].reset_index(drop=True)
             if len(duplicate_df) > 0:
                 logger.info(
                     f'inserting services dupes into the {self.source} dupe collection'
@@ -212,7 +288,10 @@ class BaseScraper:
             logger.info(f'final df shape: {df.shape}')
             self.add_required_fields(df)
             if len(df) > 0:
-                insert_services(df.to_dict('records'), client, self.dump_collection)
+                insert_services(
+                    df.to_dict('records'), client, self.dump_collection, enrich_hook
+                )
+                self.update_prefilter(prefilter, df, client)
                 logger.info('updating last scraped date in data-sources collection')
                 client['data-sources'].update_one(
                     {"name": self.data_source_collection_name},
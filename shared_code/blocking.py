@@ -0,0 +1,208 @@
+import logging
+from abc import ABC, abstractmethod
+
+import numpy as np
+from pymongo import ASCENDING
+
+from shared_code.utils import normalize_name, batch_distance, has_zip, zip_key, _refresh_field
+
+logger = logging.getLogger(__name__)
+
+
+def _text(value):
+    if not isinstance(value, str):
+        return None
+    return ' '.join(value.upper().split()) or None
+
+
+def _name_prefix(record, size):
+    name = record.get('name', record.get('NAME'))
+    if not isinstance(name, str):
+        return None
+    return ''.join(normalize_name(name).split())[:size].upper() or None
+
+
+class BlockingStrategy(ABC):
+    """A blocking key: the field a candidate query filters on, and how its value
+       is derived from a service. Strategies whose field is derived are stored
+       on the services by refresh_blocking_fields, with an index on the field.
+    """
+
+    field = None
+    derived = True
+
+    @abstractmethod
+    def value(self, record):
+        """The blocking value of a service or row, or None if it has none."""
+
+    def query(self, record):
+        value = self.value(record)
+        if value is None:
+            return None
+        return {self.field: value}
+
+
+class ZipBlocking(BlockingStrategy):
+    """Services in the same zip code, the default block of the dedup stage."""
+
+    field = 'zip'
+    derived = False
+
+    def value(self, record):
+        zipcode = record.get('zip')
+        if not has_zip(zipcode):
+            return None
+        if isinstance(zipcode, np.integer):
+            zipcode = int(zipcode)
+        return zipcode
+
+
+class CityStateBlocking(BlockingStrategy):
+    """Services in the same city and state or province whose normalized names
+       start with the same prefix_size letters, ignoring spaces. The prefix keeps
+       the blocks of large cities such as New York bounded.
+    """
+
+    field = 'city_state'
+
+    def __init__(self, prefix_size: int = 2) -> None:
+        self.prefix_size = prefix_size
+
+    def value(self, record):
+        city, state = _text(record.get('city')), _text(record.get('state'))
+        prefix = _name_prefix(record, self.prefix_size)
+        if city is None or state is None or prefix is None:
+            return None
+        return f'{city}|{state}|{prefix}'
+
+
+class StateNamePrefixBlocking(BlockingStrategy):
+    """Services in the same state or province whose normalized names start
+       with the same prefix_size letters, ignoring spaces.
+    """
+
+    field = 'state_name_prefix'
+
+    def __init__(self, prefix_size: int = 4) -> None:
+        self.prefix_size = prefix_size
+
+    def value(self, record):
+        state, prefix = _text(record.get('state')), _name_prefix(record, self.prefix_size)
+        if state is None or prefix is None:
+            return None
+        return f'{state}|{prefix}'
+
+
+# Tried in order, the first strategy a row has a value for is its block
+BLOCKING_STRATEGIES = [ZipBlocking(), CityStateBlocking(), StateNamePrefixBlocking()]
+
+
+def _block(record, strategies):
+    for strategy in strategies:
+        value = strategy.value(record)
+        if value is not None:
+            return strategy, value
+    return None, None
+
+
+def refresh_blocking_fields(client, collection, strategies=None, batch_size=1000):
+    """Store the derived blocking fields on every service of the collection whose
+       stored values are missing or out of date, e.g. after its name, city or
+       state changed, and ensure every blocking field is indexed.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        strategies (list, optional): BlockingStrategy objects. Defaults to BLOCKING_STRATEGIES.
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    strategies = BLOCKING_STRATEGIES if strategies is None else strategies
+    derived = [s for s in strategies if s.derived]
+    coll = client[collection]
+    updated = 0
+    if derived:
+        def compute(document):
+            values = {s.field: s.value(document) for s in derived}
+            if all(field in document and document[field] == v for field, v in values.items()):
+                return None
+            return values
+
+        projection = dict.fromkeys(['name', 'NAME', 'city', 'state'] + [s.field for s in derived], 1)
+        updated = _refresh_field(coll, {}, projection, compute, batch_size)
+    indexes = coll.index_information()
+    for strategy in strategies:
+        if f'{strategy.field}_1' not in indexes:
+            coll.create_index([(strategy.field, ASCENDING)])
+    return updated
+
+
+def fetch_blocks(records, client, collection, strategies=None, chunk_size=500):
+    """The services of the blocks of many rows, fetched with $in queries over
+       chunks of block values instead of one query per row.
+
+    Args:
+        records (list): the incoming rows, as dicts
+        client (obj): pymongo MongoClient object
+        collection (str): name of the db collection
+        strategies (list, optional): BlockingStrategy objects. Defaults to BLOCKING_STRATEGIES.
+        chunk_size (int, optional): block values per query. Defaults to 500.
+
+    Returns:
+        dict: (field, value) of every block -> names of its services
+    """
+    strategies = BLOCKING_STRATEGIES if strategies is None else strategies
+    wanted = {}
+    for record in records:
+        strategy, value = _block(record, strategies)
+        if strategy is not None:
+            wanted.setdefault(strategy.field, set()).add(value)
+    blocks = {(field, zip_key(v)): [] for field, values in wanted.items() for v in values}
+    for field, values in wanted.items():
+        values = list(values)
+        for start in range(0, len(values), chunk_size):
+            found = client[collection].find(
+                {field: {'$in': values[start:start + chunk_size]}}, {'name': 1, field: 1}
+            )
+            for document in found:
+                names = blocks.get((field, zip_key(document.get(field))))
+                if names is not None and document.get('name') is not None:
+                    names.append(document['name'])
+    logger.info(f'fetched {len(blocks)} blocks for {len(records)} rows')
+    return blocks
+
+
+def locate_blocked_duplicate(record, client, collection, strategies=None, blocks=None):
+    """Most similar service in the first block the row has a value for, e.g.
+       its city and state when it has no zip.
+
+    Args:
+        record (dict): the incoming row, with a name and some of zip, city and state
+        client (obj): pymongo MongoClient object
+        collection (str): name of the db collection
+        strategies (list, optional): BlockingStrategy objects. Defaults to BLOCKING_STRATEGIES.
+        blocks (dict, optional): blocks prefetched with fetch_blocks, the block is
+            queried when it is not among them. Defaults to None.
+
+    Returns:
+        tuple: (name of the service that might be a duplicate or False, the field
+        of the block that was searched or None)
+    """
+    strategies = BLOCKING_STRATEGIES if strategies is None else strategies
+    strategy, value = _block(record, strategies)
+    if strategy is None:
+        return False, None
+    names = (blocks or {}).get((strategy.field, zip_key(value)))
+    if names is None:
+        names = [
+            d['name'] for d in client[collection].find(strategy.query(record), {'name': 1})
+            if d.get('name') is not None
+        ]
+    if not names:
+        return False, strategy.field
+    similarities = batch_distance(
+        normalize_name(str(record.get('name'))), [normalize_name(str(n)) for n in names]
+    )
+    return names[int(np.argmax(np.nan_to_num(similarities, nan=-np.inf)))], strategy.field
@@ -0,0 +1,36 @@
+class CandidateIndex:
+    """Base of the candidate indexes of the dedup stage, see
+       shared_code.dedup.DEDUP_INDEXES.
+
+       Subclasses implement candidates(), best candidate first, and get the
+       lookup() that find_service_duplicates counts retrieved candidates with,
+       and the locate_potential_duplicate() drop-in built on it.
+    """
+
+    # position of the service name in the tuples returned by candidates()
+    name_position = 0
+
+    def candidates(self, name, zipcode) -> list:
+        """Services that might be duplicates of name, best candidate first.
+
+        Returns:
+            list: tuples holding the service name at name_position
+        """
+        raise NotImplementedError
+
+    def lookup(self, name, zipcode) -> tuple:
+        """The best candidate of name, and how many candidates were retrieved.
+
+        Returns:
+            tuple: (name of the best candidate or False, number of candidates)
+        """
+        candidates = self.candidates(name, zipcode)
+        return (candidates[0][self.name_position] if candidates else False), len(candidates)
+
+    def locate_potential_duplicate(self, name, zipcode):
+        """Drop-in for shared_code.utils.locate_potential_duplicate.
+
+        Returns:
+            str: name of the best candidate that might be a duplicate, or False
+        """
+        return self.lookup(name, zipcode)[0]
@@ -0,0 +1,81 @@
+import logging
+
+from shared_code.utils import bounded_distance, max_edits, normalize_name
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityCascade:
+    """Decides which of a list of candidate names is a duplicate of a service,
+       running cheap filters before the bounded edit distance.
+
+       Every stage is a necessary condition for the Levenshtein similarity of
+       the normalized names to reach threshold, so the cascade accepts exactly
+       the pairs check_similarity accepts:
+
+       - length ratio: the length difference is a lower bound of the edit distance.
+       - token Jaccard: one edit changes at most three whitespace tokens (a
+         substitution swaps one, inserting or deleting a space splits or merges
+         one), so token sets that differ by more than 3 * k tokens are rejected.
+       - bounded edit distance: shared_code.utils.bounded_distance.
+
+       stats counts the pairs each stage eliminated.
+    """
+
+    STAGES = ('length_ratio', 'token_jaccard', 'edit_distance')
+
+    def __init__(self, threshold: float = 0.9) -> None:
+        self.threshold = threshold
+        self.stats = dict.fromkeys(('pairs',) + self.STAGES + ('accepted',), 0)
+
+    def similarity(self, name, candidate):
+        """Run one pair through the cascade.
+
+        Args:
+            name (str): normalized name of the service you want to add
+            candidate (str): normalized name of an existing service
+
+        Returns:
+            float: the similarity, or None if a stage rejected the pair
+        """
+        self.stats['pairs'] += 1
+        shorter, longer = sorted((len(name), len(candidate)))
+        k = max_edits(shorter, self.threshold)
+        if k < 0 or longer - shorter > k:
+            self.stats['length_ratio'] += 1
+            return None
+        tokens, candidate_tokens = set(name.split()), set(candidate.split())
+        if len(tokens ^ candidate_tokens) > 3 * k:
+            self.stats['token_jaccard'] += 1
+            return None
+        similarity = bounded_distance(name, candidate, self.threshold)
+        if similarity is None:
+            self.stats['edit_distance'] += 1
+            return None
+        self.stats['accepted'] += 1
+        return similarity
+
+    def best_match(self, normalized, candidates):
+        """The most similar candidate that passes the cascade.
+
+        Args:
+            normalized (str): normalized name of the service you want to add
+            candidates (list): names of existing services, e.g. the top-k
+                text search matches
+
+        Returns:
+            str: name of the best matching candidate, or None
+        """
+        best, best_similarity = None, None
+        for candidate in candidates:
+            similarity = self.similarity(normalized, normalize_name(str(candidate)))
+            if similarity is not None and (best_similarity is None or similarity > best_similarity):
+                best, best_similarity = candidate, similarity
+        return best
+
+    def log_stats(self) -> None:
+        eliminated = ', '.join(f'{stage}: {self.stats[stage]}' for stage in self.STAGES)
+        logger.info(
+            f'similarity cascade: {self.stats["pairs"]} pairs, eliminated by {eliminated}, '
+            f'{self.stats["accepted"]} accepted'
+        )
@@ -0,0 +1,144 @@
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pytz import timezone
+
+from shared_code.utils import normalize_name, zip_key
+
+logger = logging.getLogger(__name__)
+
+
+def services_version(client, collection):
+    """Version marker of a collection that changes whenever services are added,
+       removed or updated: document count, newest _id and newest updatedAt.
+       Ensures updatedAt is indexed, so that the newest one is a single index read.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection
+
+    Returns:
+        str: the version marker
+    """
+    coll = client[collection]
+    if 'updatedAt_1' not in coll.index_information().keys():
+        coll.create_index([('updatedAt', ASCENDING)])
+    newest = coll.find_one({}, {'_id': 1}, sort=[('_id', DESCENDING)])
+    updated = coll.find_one(
+        {'updatedAt': {'$exists': True}}, {'updatedAt': 1}, sort=[('updatedAt', DESCENDING)]
+    )
+    return ':'.join([
+        str(coll.estimated_document_count()),
+        str(newest['_id']) if newest else '',
+        updated['updatedAt'].isoformat() if updated else '',
+    ])
+
+
+class DecisionCache:
+    """Persistent cache of dedup decisions for (normalized name, zip) pairs,
+       stored in a MongoDB collection.
+
+       Entries are only valid for the services version they were computed
+       against, so any change to the check collection invalidates them, and
+       are kept per dedup engine, since engines retrieve different candidates
+       and may decide the same row differently. The
+       entries of the current version are loaded with one query, and new
+       decisions, hit timestamps, invalidation and least-recently-used eviction
+       are written back with a few bulk operations in flush().
+    """
+
+    def __init__(self, client, check_collection: str, engine: str = 'text',
+                 cache_collection: str = 'dedup-decisions',
+                 max_entries: int = 500000) -> None:
+        self._coll = client[cache_collection]
+        self._check_collection = check_collection
+        self._engine = engine
+        self._max_entries = max_entries
+        self._version = services_version(client, check_collection)
+        self._entries = {}
+        self._hits = set()
+        self._new = {}
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @classmethod
+    def load(cls, client, check_collection, **kwargs):
+        """Create the cache and read all valid entries for the check collection."""
+        cache = cls(client, check_collection, **kwargs)
+        cache._coll.create_index(
+            [('check_collection', ASCENDING), ('engine', ASCENDING),
+             ('name', ASCENDING), ('zip', ASCENDING)],
+            unique=True
+        )
+        cache._coll.create_index([('used_at', ASCENDING)])
+        for entry in cache._coll.find(
+            {'check_collection': check_collection, 'engine': cache._engine,
+             'version': cache._version},
+            {'name': 1, 'zip': 1, 'duplicate': 1, 'match': 1}
+        ):
+            cache._entries[(entry['name'], entry['zip'])] = (entry['duplicate'], entry.get('match'))
+        logger.info(f'loaded {len(cache._entries)} cached dedup decisions')
+        return cache
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, name, zipcode):
+        return normalize_name(str(name)), zip_key(zipcode)
+
+    def get(self, name, zipcode):
+        """Look up the cached decision for a service.
+
+        Returns:
+            tuple: (duplicate, match) where match is the name of the matched
+            service, or None if the pair has no valid entry
+        """
+        key = self._key(name, zipcode)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        self._hits.add(key)
+        return entry
+
+    def put(self, name, zipcode, duplicate, match=None) -> None:
+        key = self._key(name, zipcode)
+        self._entries[key] = (bool(duplicate), match if match is not False else None)
+        self._new[key] = self._entries[key]
+
+    def flush(self) -> None:
+        """Persist new decisions and hit times, drop entries of old services
+           versions and evict the least recently used entries beyond max_entries.
+        """
+        now = datetime.now(timezone('UTC'))
+        selector = {'check_collection': self._check_collection, 'engine': self._engine}
+        operations = [
+            UpdateOne(
+                dict(selector, name=name, zip=zipcode),
+                {'$set': {
+                    'version': self._version, 'duplicate': duplicate,
+                    'match': match, 'used_at': now
+                }},
+                upsert=True
+            )
+            for (name, zipcode), (duplicate, match) in self._new.items()
+        ]
+        operations += [
+            UpdateOne(dict(selector, name=name, zip=zipcode), {'$set': {'used_at': now}})
+            for name, zipcode in self._hits - set(self._new)
+        ]
+        if operations:
+            self._coll.bulk_write(operations, ordered=False)
+        self._coll.delete_many(dict(selector, version={'$ne': self._version}))
+        excess = self._coll.count_documents({}) - self._max_entries
+        if excess > 0:
+            oldest = self._coll.find({}, {'_id': 1}).sort('used_at', ASCENDING).limit(excess)
+            self._coll.delete_many({'_id': {'$in': [d['_id'] for d in oldest]}})
+        logger.info(
+            f'dedup decision cache: {self.hit_count} hits, {self.miss_count} misses, '
+            f'{len(self._new)} new entries'
+        )
+        self._new = {}
+        self._hits = set()
@@ -0,0 +1,858 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from shared_code.utils import (
+    ngram_terms, locate_potential_duplicate, locate_potential_duplicates, refresh_ngrams,
+    normalize_name, batch_distance, make_qgrams, refresh_qgrams,
+    make_ngrams, name_hash, refresh_normalized_names, bounded_distance, refresh_blocking_keys,
+    refresh_exact_keys, has_zip, zip_key
+)
+from shared_code.phonetic import blocking_keys, blocking_keys_hash
+from shared_code.candidate_index import CandidateIndex
+from shared_code.exact_keys import exact_keys, exact_keys_hash
+from shared_code.normalizer import normalize_names
+from shared_code.cascade import SimilarityCascade
+from shared_code.geo_grid import GeoGridIndex, coordinates
+from shared_code.dedup_profile import DedupProfiler
+from shared_code.blocking import (
+    BLOCKING_STRATEGIES, refresh_blocking_fields, locate_blocked_duplicate, fetch_blocks, _block
+)
+from shared_code.minhash import MinHasher, MinHashIndex
+from shared_code.sqlite_replica import ServicesReplica
+from shared_code.decision_cache import DecisionCache
+from shared_code.parallel_dedup import find_service_duplicates_parallel
+
+logger = logging.getLogger(__name__)
+
+
+class NgramIndex(CandidateIndex):
+    """In-process inverted index over the n-gram terms of service names,
+       partitioned by zip code.
+
+       It answers the same question as the MongoDB $text query in
+       locate_potential_duplicate, but is built once per run from a projection
+       of the check collection so that candidate lookups are local.
+    """
+
+    name_position = 1
+
+    def __init__(self, min_size: int = 7) -> None:
+        self._min_size = min_size
+        self._names = []
+        self._ids = []
+        self._partitions = defaultdict(lambda: defaultdict(list))
+
+    @classmethod
+    def from_collection(cls, client, collection, min_size=7):
+        """Build the index from the name, zip and _id of every service in a collection.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the db collection
+            min_size (int, optional): the minimum number of characters in one ngram. Defaults to 7.
+
+        Returns:
+            NgramIndex: the populated index
+        """
+        index = cls(min_size)
+        projection = {'_id': 1, 'name': 1, 'NAME': 1, 'zip': 1}
+        for document in tqdm(client[collection].find({}, projection)):
+            name = document.get('name', document.get('NAME'))
+            if name is None:
+                continue
+            index.add(document['_id'], name, document.get('zip'))
+        logger.info(f'indexed {len(index)} services from {collection}')
+        return index
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, _id, name, zipcode) -> None:
+        doc = len(self._names)
+        self._names.append(name)
+        self._ids.append(_id)
+        partition = self._partitions[zip_key(zipcode)]
+        for term in ngram_terms(str(name).upper(), self._min_size):
+            partition[term].append(doc)
+
+    def candidates(self, name, zipcode) -> list:
+        """Services in the same zip sharing at least one n-gram term with name.
+
+        Args:
+            name (str): name of the service you want to add
+            zipcode (str): zip code of the service you want to add
+
+        Returns:
+            list: (_id, name, score) tuples, best score first, where score is
+            the number of shared terms
+        """
+        return [(self._ids[doc], self._names[doc], score) for doc, score in self._ranked(name, zipcode)]
+
+    def _ranked(self, name, zipcode) -> list:
+        partition = self._partitions.get(zip_key(zipcode))
+        if not partition:
+            return []
+        scores = defaultdict(int)
+        for term in ngram_terms(str(name).upper(), self._min_size):
+            for doc in partition.get(term, ()):
+                scores[doc] += 1
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def dump_collections(client, exclude=()):
+    """Names of the tmp* dump collections scrapers write to before promotion,
+       leaving out their *Duplicates collections.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        exclude (list, optional): collection names to leave out. Defaults to ().
+
+    Returns:
+        list: the collection names, sorted
+    """
+    return sorted(
+        name for name in client.list_collection_names()
+        if name.startswith('tmp') and not name.endswith('Duplicates') and name not in exclude
+    )
+
+
+class CrossSourceIndex(NgramIndex):
+    """NgramIndex over several collections at once, e.g. services and every
+       tmp* dump collection, remembering which collection each service came from.
+
+       Incoming rows are checked against all sources in a single pass instead
+       of one round trip per row and collection, see check_cross_source_duplicates.
+    """
+
+    def __init__(self, min_size: int = 7) -> None:
+        super().__init__(min_size)
+        self._collections = []
+
+    @classmethod
+    def from_collections(cls, client, collections, min_size=7):
+        """Build the index from the name, zip and _id of every service in the collections.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collections (list): names of the db collections
+            min_size (int, optional): the minimum number of characters in one ngram. Defaults to 7.
+
+        Returns:
+            CrossSourceIndex: the populated index
+        """
+        index = cls(min_size)
+        projection = {'_id': 1, 'name': 1, 'NAME': 1, 'zip': 1}
+        for collection in collections:
+            for document in tqdm(client[collection].find({}, projection)):
+                name = document.get('name', document.get('NAME'))
+                if name is None:
+                    continue
+                index.add(document['_id'], name, document.get('zip'), collection)
+        logger.info(f'indexed {len(index)} services from {len(collections)} collections')
+        return index
+
+    def add(self, _id, name, zipcode, collection=None) -> None:
+        super().add(_id, name, zipcode)
+        self._collections.append(collection)
+
+    def matches(self, name, zipcode, limit=10) -> list:
+        """The best limit candidates of name, with the collection they are stored in.
+
+        Returns:
+            list: (name, collection) tuples, best score first
+        """
+        ranked = self._ranked(name, zipcode)[:limit]
+        return [(self._names[doc], self._collections[doc]) for doc, _ in ranked]
+
+
+class ZipGroupedCandidates(CandidateIndex):
+    """Candidate lookup that fetches the services of many zip codes per query.
+
+       Instead of one $text query per incoming row, prefetch() pulls the name
+       and zip of every service in the incoming zips with $in queries over
+       chunks of zips, and each row is then resolved client-side by scoring it
+       against all services in its zip with batch_distance.
+    """
+
+    def __init__(self, client, collection, chunk_size: int = 500) -> None:
+        self._coll = client[collection]
+        self._chunk_size = chunk_size
+        self._groups = {}
+
+    @classmethod
+    def from_collection(cls, client, collection, chunk_size=500):
+        return cls(client, collection, chunk_size)
+
+    def __len__(self) -> int:
+        return sum(len(names) for names, _, _ in self._groups.values())
+
+    def prefetch(self, zipcodes) -> None:
+        """Fetch the services of all given zip codes that are not cached yet.
+
+        Args:
+            zipcodes (list): zip codes of the incoming rows
+        """
+        pending = {}
+        for z in zipcodes:
+            if isinstance(z, np.integer):
+                z = int(z)
+            if zip_key(z) not in self._groups:
+                pending[zip_key(z)] = z
+        for key in pending:
+            self._groups[key] = ([], [], [])
+        values = list(pending.values())
+        for start in range(0, len(values), self._chunk_size):
+            chunk = values[start:start + self._chunk_size]
+            for document in self._coll.find({'zip': {'$in': chunk}}, {'name': 1, 'zip': 1}):
+                if document.get('name') is None:
+                    continue
+                names, normalized, ids = self._groups[zip_key(document.get('zip'))]
+                names.append(document['name'])
+                normalized.append(normalize_name(str(document['name'])))
+                ids.append(document['_id'])
+        logger.info(f'fetched candidates for {len(values)} zips in '
+                    f'{-(-len(values) // self._chunk_size)} queries')
+
+    def group(self, zipcode) -> tuple:
+        """The services of one zip code, fetched if they are not cached yet.
+
+        Returns:
+            tuple: (names, normalized names, _ids) lists
+        """
+        if zip_key(zipcode) not in self._groups:
+            self.prefetch([zipcode])
+        return self._groups[zip_key(zipcode)]
+
+    def candidates(self, name, zipcode) -> list:
+        """All services in the zip of name, scored against it.
+
+        Returns:
+            list: (name, similarity) tuples, most similar first
+        """
+        names, normalized, _ = self.group(zipcode)
+        if not names:
+            return []
+        similarities = batch_distance(normalize_name(str(name)), normalized)
+        order = np.argsort(-np.nan_to_num(similarities, nan=-np.inf), kind='stable')
+        return [(names[i], float(similarities[i])) for i in order]
+
+
+class QgramIndex(CandidateIndex):
+    """Candidate lookup against the compact qgrams field of the check collection.
+
+       Each row is still one MongoDB query, but an indexed (zip, qgrams) $in
+       match on a few dozen integer ids instead of a $text search over the
+       full n-gram string. Candidates are ranked by the number of shared q-grams.
+    """
+
+    name_position = 1
+
+    def __init__(self, client, collection) -> None:
+        self._coll = client[collection]
+
+    @classmethod
+    def from_collection(cls, client, collection):
+        """Migrate any services with missing or stale qgrams and return the query path."""
+        updated = refresh_qgrams(client, collection)
+        logger.info(f'added qgrams to {updated} services in {collection}')
+        return cls(client, collection)
+
+    def candidates(self, name, zipcode) -> list:
+        """Services in the same zip sharing at least one q-gram with name.
+
+        Returns:
+            list: (_id, name, score) tuples, best score first, where score is
+            the number of shared q-grams
+        """
+        if isinstance(zipcode, np.integer):
+            zipcode = int(zipcode)
+        qgrams = make_qgrams(name)
+        found = self._coll.find(
+            {'zip': zipcode, 'qgrams': {'$in': qgrams}}, {'name': 1, 'qgrams': 1}
+        )
+        query = set(qgrams)
+        ranked = sorted(
+            ((d['_id'], d['name'], len(query.intersection(d['qgrams']))) for d in found),
+            key=lambda item: -item[2]
+        )
+        return ranked
+
+
+class PhoneticIndex(CandidateIndex):
+    """Candidate lookup against the phonetic blocking_keys field of the check
+       collection, see shared_code.phonetic.blocking_keys.
+
+       Each row is one indexed (zip, blocking_keys) $in query instead of a $text
+       search, and Soundex codes also match spelling variants of short names
+       that share no 7-character n-gram. Candidates are ranked by the number
+       of shared keys.
+    """
+
+    name_position = 1
+
+    def __init__(self, client, collection) -> None:
+        self._coll = client[collection]
+
+    @classmethod
+    def from_collection(cls, client, collection):
+        """Add blocking keys to any services with missing or stale keys and return the query path."""
+        updated = refresh_blocking_keys(client, collection)
+        logger.info(f'added blocking keys to {updated} services in {collection}')
+        return cls(client, collection)
+
+    def candidates(self, name, zipcode) -> list:
+        """Services in the same zip sharing at least one blocking key with name.
+
+        Returns:
+            list: (_id, name, score) tuples, best score first, where score is
+            the number of shared keys
+        """
+        if isinstance(zipcode, np.integer):
+            zipcode = int(zipcode)
+        keys = blocking_keys(name)
+        found = self._coll.find(
+            {'zip': zipcode, 'blocking_keys': {'$in': keys}}, {'name': 1, 'blocking_keys': 1}
+        )
+        query = set(keys)
+        return sorted(
+            ((d['_id'], d['name'], len(query.intersection(d['blocking_keys']))) for d in found),
+            key=lambda item: -item[2]
+        )
+
+
+DEDUP_INDEXES = {
+    'ngram': NgramIndex,
+    'minhash': MinHashIndex,
+    'sqlite': ServicesReplica,
+    'zip': ZipGroupedCandidates,
+    'qgram': QgramIndex,
+    'phonetic': PhoneticIndex,
+    'geo': GeoGridIndex,
+}
+
+
+def build_dedup_index(kind, client, collection):
+    """Build the in-process candidate index selected by a scraper's dedup flag.
+
+    Args:
+        kind (str): one of the keys of DEDUP_INDEXES, or None for MongoDB $text search
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to index
+
+    Returns:
+        obj: the index, or None when kind is None
+    """
+    if kind is None:
+        return None
+    try:
+        index_class = DEDUP_INDEXES[kind]
+    except KeyError:
+        raise ValueError(
+            f'unknown dedup index {kind!r}, expected one of {sorted(DEDUP_INDEXES)}'
+        )
+    return index_class.from_collection(client, collection)
+
+
+def enrich_services(records):
+    """insert_services hook adding the dedup fields to a batch of records at write time,
+       so that services promoted from a tmp collection never need refresh_ngrams,
+       refresh_qgrams, refresh_blocking_keys, refresh_exact_keys or a MinHashIndex
+       signature pass.
+
+       Adds ngrams and qgrams with their name hash, normalized_name, blocking_keys and
+       exact_keys with their hash, and the minhash signature with its minhash_name. Normalization and signatures are
+       computed for the whole batch at once.
+
+    Args:
+        records (list): list of service dicts, as passed to insert_services
+
+    Returns:
+        list: the same records, enriched in place
+    """
+    named = [r for r in records if r.get('name', r.get('NAME')) is not None]
+    if not named:
+        return records
+    names = pd.Series([str(r.get('name', r.get('NAME'))) for r in named])
+    upper = names.str.upper()
+    normalized = normalize_names(names)
+    ngrams = upper.map(lambda n: ' '.join(make_ngrams(n)))
+    hashes = upper.map(name_hash)
+    qgrams = upper.map(make_qgrams)
+    signatures = MinHasher().signatures(list(names))
+    for i, record in enumerate(named):
+        record['ngrams'] = ngrams[i]
+        record['ngrams_hash'] = hashes[i]
+        record['qgrams'] = qgrams[i]
+        record['qgrams_hash'] = hashes[i]
+        record['normalized_name'] = normalized[i]
+        record['normalized_name_hash'] = name_hash(names[i], upper=False)
+        record['blocking_keys'] = blocking_keys(names[i])
+        record['blocking_keys_hash'] = blocking_keys_hash(record)
+        record['exact_keys'] = exact_keys(record)
+        record['exact_keys_hash'] = exact_keys_hash(record)
+        record['minhash'] = signatures[i].tolist()
+        record['minhash_name'] = normalized[i]
+    return records
+
+
+def find_intra_batch_duplicates(df, window=10, threshold=0.9):
+    """Find the rows of a DataFrame that fuzzy-match an earlier row of the same
+       DataFrame, with sorted-neighbourhood blocking.
+
+       Rows are blocked by zip, or by the first of BLOCKING_STRATEGIES they have
+       a value for when the zip is missing, and sorted by normalized name, once
+       forwards and once by the reversed name so that differences at the start
+       of a name are caught too. Rows without any block are left out. Each row is
+       only compared with the next window - 1 rows of its block, so the cost is
+       O(n log n + n * window) instead of pairwise. Matches are merged
+       transitively, and the first row of every cluster is kept.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with a name and, usually, a zip column
+        window (int, optional): size of the sliding window. Defaults to 10.
+        threshold (float, optional): minimum similarity. Defaults to 0.9.
+
+    Returns:
+        list: index labels of the rows that duplicate an earlier row
+    """
+    if len(df) < 2:
+        return []
+    normalized = normalize_names(df['name']).tolist()
+    blocks = []
+    for record in df.to_dict('records'):
+        strategy, value = _block(record, BLOCKING_STRATEGIES)
+        blocks.append(None if strategy is None else (strategy.field, zip_key(value)))
+    blocked = [i for i in range(len(df)) if blocks[i] is not None]
+    parent = list(range(len(df)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for key in (normalized, [n[::-1] for n in normalized]):
+        order = sorted(blocked, key=lambda i: (blocks[i], key[i]))
+        for start, i in enumerate(order):
+            for j in order[start + 1:start + window]:
+                if blocks[j] != blocks[i]:
+                    break
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j and bounded_distance(normalized[i], normalized[j], threshold) is not None:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+    return [label for i, label in enumerate(df.index) if find(i) != i]
+
+
+def drop_intra_batch_duplicates(df, window=10):
+    """Split the fuzzy duplicates within a DataFrame off from it, see
+       find_intra_batch_duplicates.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with a name and, usually, a zip column
+        window (int, optional): size of the sliding window. Defaults to 10.
+
+    Returns:
+        tuple: (df without the duplicates, the duplicates), both re-indexed
+    """
+    duplicates = find_intra_batch_duplicates(df, window)
+    logger.info(f'{len(duplicates)} rows fuzzy-match an earlier row of the same batch')
+    return (
+        df.drop(duplicates).reset_index(drop=True),
+        df.loc[duplicates].reset_index(drop=True)
+    )
+
+
+def find_exact_key_duplicates(df, client, collection, threshold=0.7, chunk_size=1000):
+    """Find the rows sharing an exact key (phone, website domain, email or address
+       hash) with a service of the same zip, with a few $in queries on the
+       (zip, exact_keys) index.
+
+       Agencies share phone lines, city and county services share a domain and
+       buildings host several services, so a shared key alone is not enough: the
+       names must also pass a SimilarityCascade, at a lower threshold than the
+       fuzzy stage since the shared key is strong evidence on its own.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with name and zip columns
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        threshold (float, optional): minimum name similarity. Defaults to 0.7.
+        chunk_size (int, optional): keys per query. Defaults to 1000.
+
+    Returns:
+        dict: index label of every duplicate row -> (the shared key, name of the
+        matched service)
+    """
+    if 'zip' not in df.columns or len(df) == 0:
+        return {}
+    rows = [(label, zip_key(record.get('zip')), exact_keys(record), record.get('name'))
+            for label, record in zip(df.index, df.to_dict('records'))]
+    wanted = sorted({key for _, _, keys, _ in rows for key in keys})
+    if not wanted:
+        return {}
+    zips = {z for _, z, _, _ in rows}
+    zip_values = list({v for z in zips for v in (z, int(z) if z.isdigit() else z)})
+    existing = defaultdict(list)
+    for start in range(0, len(wanted), chunk_size):
+        found = client[collection].find(
+            {'zip': {'$in': zip_values}, 'exact_keys': {'$in': wanted[start:start + chunk_size]}},
+            {'_id': 0, 'zip': 1, 'exact_keys': 1, 'name': 1}
+        )
+        for document in found:
+            if document.get('name') is None:
+                continue
+            for key in document['exact_keys']:
+                existing[(zip_key(document.get('zip')), key)].append(document['name'])
+    cascade = SimilarityCascade(threshold)
+    found_duplicates = {}
+    for label, z, keys, name in rows:
+        normalized = normalize_name(str(name))
+        for key in keys:
+            match = cascade.best_match(normalized, existing.get((z, key), []))
+            if match is not None:
+                found_duplicates[label] = (key, match)
+                break
+    cascade.log_stats()
+    return found_duplicates
+
+
+def find_exact_normalized_duplicates(df, client, collection, chunk_size=1000):
+    """Find the rows whose normalized name already exists in the same zip,
+       with a few $in queries on the (zip, normalized_name) index.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with name and zip columns
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        chunk_size (int, optional): normalized names per query. Defaults to 1000.
+
+    Returns:
+        list: index labels of the rows that are exact normalized duplicates
+    """
+    if 'zip' not in df.columns or len(df) == 0:
+        return []
+    normalized = normalize_names(df['name'])
+    zips = df['zip'].map(zip_key)
+    # an empty normalized name says nothing about the service, so it never matches
+    wanted = sorted(set(normalized) - {''})
+    # zips may be stored as strings or numbers, so query both forms
+    zip_values = list({v for z in zips for v in (z, int(z) if z.isdigit() else z)})
+    existing = set()
+    for start in range(0, len(wanted), chunk_size):
+        found = client[collection].find(
+            {'zip': {'$in': zip_values}, 'normalized_name': {'$in': wanted[start:start + chunk_size]}},
+            {'_id': 0, 'zip': 1, 'normalized_name': 1}
+        )
+        existing.update((zip_key(d.get('zip')), d['normalized_name']) for d in found)
+    return [i for i, z, n in zip(df.index, zips, normalized) if n and (z, n) in existing]
+
+
+def find_service_duplicates(df, client, collection, index=None, cache=None, top_k=None,
+                            profiler=None):
+    """Find the rows of a DataFrame that fuzzy-match a service in the collection.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with a name and, usually, a zip column
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        index (obj, optional): in-process candidate index, see build_dedup_index. Rows
+            with lat/lon are looked up by proximity and zip when the index supports it,
+            e.g. GeoGridIndex. Rows without a zip are looked up in their block, see
+            shared_code.blocking. Defaults to None.
+        cache (DecisionCache, optional): decisions of earlier runs to reuse, and to
+            record new decisions in. Defaults to None.
+        top_k (int, optional): without an index, compare against the top_k best text
+            search matches instead of the first one found. Defaults to None.
+        profiler (DedupProfiler, optional): record candidates, lookup latency, similarity
+            computations and the decision of every row. Defaults to None.
+
+    Returns:
+        list: index labels of the rows that are duplicates
+    """
+    zip_column = 'zip' in df.columns
+    if zip_column and hasattr(index, 'prefetch'):
+        index.prefetch([z for z in df['zip'].unique() if has_zip(z)])
+    geo = hasattr(index, 'lookup_nearby')
+    zipless_rows = [record for record in df.to_dict('records') if not has_zip(record.get('zip'))]
+    blocks = fetch_blocks(zipless_rows, client, collection) if zipless_rows else None
+    normalized = normalize_names(df['name'])
+    cascade = SimilarityCascade()
+    found_duplicates = []
+    for i in tqdm(range(len(df))):
+        name = df.loc[i, 'name']
+        zipcode = df.loc[i, 'zip'] if zip_column else None
+        zipless = not has_zip(zipcode)
+        if cache is not None and not zipless:
+            cached = cache.get(name, zipcode)
+            if cached is not None:
+                if cached[0]:
+                    found_duplicates.append(i)
+                if profiler is not None:
+                    profiler.record(i, name, zipcode, 'cache', cached[0], cached[1])
+                continue
+        point = coordinates(df.loc[i]) if geo else None
+        start = time.perf_counter()
+        # retrieved counts the services the engine looked at, not just the best one
+        if point is not None:
+            dc, retrieved = index.lookup_nearby(name, *point, zipcode)
+            candidates = [dc] if dc is not False else []
+        elif zipless:
+            # no zip to block on, fall back to city and state or a name prefix
+            dc, _ = locate_blocked_duplicate(df.loc[i], client, collection, blocks=blocks)
+            candidates = [dc] if dc is not False else []
+            retrieved = len(candidates)
+        elif top_k and index is None:
+            candidates = locate_potential_duplicates(name, zipcode, client, collection, top_k)
+            retrieved = len(candidates)
+        elif hasattr(index, 'lookup'):
+            dc, retrieved = index.lookup(name, zipcode)
+            candidates = [dc] if dc is not False else []
+        else:
+            dc = locate_potential_duplicate(name, zipcode, client, collection, index)
+            candidates = [dc] if dc is not False else []
+            retrieved = len(candidates)
+        latency_ms = (time.perf_counter() - start) * 1000
+        comparisons = cascade.stats['pairs']
+        match = cascade.best_match(normalized[i], candidates)
+        duplicate = match is not None
+        if duplicate:
+            found_duplicates.append(i)
+        if profiler is not None:
+            profiler.record(
+                i, name, zipcode, 'fuzzy', duplicate, match, retrieved, latency_ms,
+                cascade.stats['pairs'] - comparisons
+            )
+        if cache is not None and not zipless:
+            cache.put(name, zipcode, duplicate, match if duplicate else next(iter(candidates), False))
+    cascade.log_stats()
+    return found_duplicates
+
+
+def validate_dedup_options(dedup_index=None, decision_cache=False, workers=None, top_k=None,
+                           explain=False, key_match=False, cross_source=False):
+    """Reject combinations of the dedup options of a scraper run where one of them
+       would be ignored, before anything is downloaded.
+
+    Raises:
+        ValueError: naming the options that cannot be combined
+    """
+    options = {
+        'dedup_index': dedup_index, 'decision_cache': decision_cache, 'workers': workers,
+        'top_k': top_k, 'explain': explain, 'key_match': key_match,
+    }
+    if cross_source:
+        given = [name for name, value in options.items() if value]
+        if given:
+            raise ValueError(f'cross_source cannot be combined with {", ".join(given)}')
+    if workers:
+        given = [name for name in ('dedup_index', 'top_k', 'explain') if options[name]]
+        if given:
+            raise ValueError(f'workers cannot be combined with {", ".join(given)}')
+    if top_k and dedup_index is not None:
+        raise ValueError('top_k only applies to MongoDB $text search, not to a dedup_index')
+
+
+def check_service_duplicates(df, client, collection, dedup_index=None,
+                             decision_cache=False, workers=None, top_k=None, explain=False,
+                             key_match=False):
+    """The dedup stage of a scraper run: find the rows of a DataFrame that
+       fuzzy-match a service in the check collection, with the selected engine.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with a name and, usually, a zip column
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        dedup_index (str, optional): key of DEDUP_INDEXES to use instead of MongoDB
+            $text search. Defaults to None.
+        decision_cache (bool, optional): reuse and record decisions in a DecisionCache.
+            Defaults to False.
+        workers (int, optional): resolve rows in this many processes against a
+            shared-memory candidate store, instead of dedup_index. Defaults to None.
+        top_k (int, optional): without a dedup_index, run the top_k best $text matches
+            of every row through the SimilarityCascade. Defaults to None.
+        explain (bool or str, optional): profile every row with a DedupProfiler and log
+            its histograms, a path also writes the per-row JSONL trace there. Not
+            available with workers. Defaults to False.
+        key_match (bool, optional): first accept the rows sharing a phone, website
+            domain, email or address with a similarly named service of the same
+            zip, see find_exact_key_duplicates. Defaults to False.
+
+    Returns:
+        list: index labels of the rows that are duplicates
+
+    Raises:
+        ValueError: for options that cannot be combined, see validate_dedup_options
+    """
+    validate_dedup_options(dedup_index, decision_cache, workers, top_k, explain, key_match)
+    keyed = {}
+    if key_match:
+        refresh_exact_keys(client, collection)
+        keyed = find_exact_key_duplicates(df, client, collection)
+        logger.info(f'{len(keyed)} rows share a phone, domain, email or address with '
+                    f'a similarly named service of {collection}')
+    if dedup_index is None and not workers:
+        # $text search needs the ngrams, normalized names are refreshed in the same pass
+        logger.info('refreshing ngrams')
+        refresh_ngrams(client, collection)
+    else:
+        refresh_normalized_names(client, collection)
+    named = find_exact_normalized_duplicates(df.drop(index=list(keyed)), client, collection)
+    logger.info(f'{len(named)} rows match a normalized name in {collection} exactly')
+    exact = sorted(list(keyed) + named)
+    rest = df.drop(index=exact)
+    labels = rest.index
+    rest = rest.reset_index(drop=True)
+
+    profiler = None
+    if explain:
+        profiler = DedupProfiler(explain if isinstance(explain, str) else None, labels)
+        zips = df['zip'] if 'zip' in df.columns else pd.Series(None, index=df.index)
+        for label in exact:
+            key, match = keyed.get(label, (None, df.loc[label, 'name']))
+            profiler.record_exact(label, df.loc[label, 'name'], zips[label], match, key)
+
+    zipless = 'zip' not in rest.columns or not rest['zip'].map(has_zip).all()
+    if zipless and not workers:
+        logger.info('refreshing blocking fields for rows without a zip')
+        refresh_blocking_fields(client, collection)
+
+    cache = None
+    if decision_cache:
+        engine = 'parallel' if workers else dedup_index or (f'text-top{top_k}' if top_k else 'text')
+        cache = DecisionCache.load(client, collection, engine=engine)
+    if workers:
+        logger.info(f'checking for duplicates in {collection} with {workers} workers')
+        found_duplicates = find_service_duplicates_parallel(rest, client, collection, workers, cache)
+    else:
+        if dedup_index is not None:
+            logger.info(f'building {dedup_index} index of {collection}')
+        index = build_dedup_index(dedup_index, client, collection)
+        logger.info(f'checking for duplicates in {collection}')
+        found_duplicates = find_service_duplicates(
+            rest, client, collection, index, cache, top_k, profiler
+        )
+        if hasattr(index, 'close'):
+            index.close()
+    if cache is not None:
+        cache.flush()
+    if profiler is not None:
+        profiler.log_summary()
+        profiler.close()
+    return sorted(exact + [labels[i] for i in found_duplicates])
+
+
+def find_cross_source_duplicates(df, index, limit=10):
+    """Find the rows of a DataFrame that fuzzy-match a service in any of the
+       collections of a CrossSourceIndex.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with name and zip columns
+        index (CrossSourceIndex): index over the collections to check against
+        limit (int, optional): candidates per row run through the SimilarityCascade.
+            Defaults to 10.
+
+    Returns:
+        dict: index label of every duplicate row -> name of the collection it matched in
+    """
+    normalized = normalize_names(df['name'])
+    zips = df['zip'] if 'zip' in df.columns else pd.Series([None] * len(df), index=df.index)
+    cascade = SimilarityCascade()
+    found_duplicates = {}
+    for label, name, zipcode in tqdm(zip(df.index, df['name'], zips), total=len(df)):
+        candidates = index.matches(name, zipcode, limit)
+        match = cascade.best_match(normalized[label], [c for c, _ in candidates])
+        if match is not None:
+            found_duplicates[label] = next(coll for c, coll in candidates if c == match)
+    cascade.log_stats()
+    return found_duplicates
+
+
+def check_cross_source_duplicates(df, client, collection, exclude=()):
+    """The cross-source dedup stage of a scraper run: check the rows of a DataFrame
+       against the check collection and every tmp* dump collection in one pass.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with a name and zip column
+        client (obj): pymongo MongoClient object
+        collection (str): name of the check collection
+        exclude (list, optional): dump collections to leave out, usually the
+            scraper's own. Defaults to ().
+
+    Returns:
+        dict: index label of every duplicate row -> name of the collection it matched in
+    """
+    collections = [collection] + dump_collections(client, exclude)
+    logger.info(f'checking for duplicates in {", ".join(collections)}')
+    index = CrossSourceIndex.from_collections(client, collections)
+    return find_cross_source_duplicates(df, index)
+
+
+def _score_zip_group(task):
+    """Best match of every row of one zip among the services of that zip."""
+    rows, normalized_rows, normalized_group = task
+    scored = []
+    for row, name in zip(rows, normalized_rows):
+        if not normalized_group:
+            scored.append((row, None, np.nan))
+            continue
+        similarities = np.nan_to_num(batch_distance(name, normalized_group), nan=-np.inf)
+        best = int(np.argmax(similarities))
+        scored.append((row, best, similarities[best]))
+    return scored
+
+
+def resolve_service_matches(df, client, collection, workers=None, threshold=0.9,
+                            chunk_size=500):
+    """Resolve a batch of (name, zip) pairs against a collection: the services
+       of all zips are fetched with a few $in queries, and every row is scored
+       against the services of its zip, in parallel when workers is set.
+
+    Args:
+        df (pd.DataFrame): rows with name and zip columns
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        workers (int, optional): number of scoring processes, in-process when None.
+            Defaults to None.
+        threshold (float, optional): minimum similarity of a duplicate. Defaults to 0.9.
+        chunk_size (int, optional): zip codes per query. Defaults to 500.
+
+    Returns:
+        pd.DataFrame: name and zip of every row with the matched name and _id of the
+        most similar service in its zip, its similarity score and the duplicate decision
+    """
+    index = ZipGroupedCandidates(client, collection, chunk_size)
+    index.prefetch(df['zip'].unique())
+    normalized = normalize_names(df['name']).tolist()
+    by_zip = defaultdict(list)
+    for row, zipcode in enumerate(df['zip']):
+        by_zip[zip_key(zipcode)].append(row)
+    keys = list(by_zip)
+    tasks = [
+        (by_zip[key], [normalized[row] for row in by_zip[key]], index.group(key)[1])
+        for key in keys
+    ]
+    if workers:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            scored = list(executor.map(_score_zip_group, tasks, chunksize=chunksize))
+    else:
+        scored = [_score_zip_group(task) for task in tasks]
+
+    matches, ids, scores = [None] * len(df), [None] * len(df), [np.nan] * len(df)
+    for key, group_scores in zip(keys, scored):
+        names, _, group_ids = index.group(key)
+        for row, best, score in group_scores:
+            if best is not None and np.isfinite(score):
+                matches[row], ids[row], scores[row] = names[best], group_ids[best], float(score)
+    result = pd.DataFrame({'name': df['name'].tolist(), 'zip': df['zip'].tolist()})
+    result['match'] = matches
+    result['match_id'] = [str(i) if i is not None else None for i in ids]
+    result['score'] = scores
+    result['duplicate'] = result['score'] >= threshold
+    return result
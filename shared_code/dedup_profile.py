@@ -0,0 +1,137 @@
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS = [0, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, np.inf]
+CANDIDATE_BUCKETS = [0, 1, 2, 5, 10, 50, 100, 500, 1000, np.inf]
+
+
+def _label(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class DedupProfiler:
+    """Explain mode of the dedup stage: records, for every row, the candidates
+       retrieved, the lookup latency, the similarity computations performed
+       and the decision, and summarizes them as histograms.
+
+       With a trace_path, every row is also written as one JSON line as soon
+       as it is decided, so the trace of a long run can be followed live.
+    """
+
+    def __init__(self, trace_path: str = None, labels=None) -> None:
+        self._labels = labels
+        self._trace = open(trace_path, 'w') if trace_path else None
+        self.rows = []
+
+    def record(self, row, name, zipcode, stage, duplicate, match=None,
+               candidates=0, latency_ms=0.0, comparisons=0) -> None:
+        """Record the decision for one row.
+
+        Args:
+            row (int): position of the row in the checked DataFrame, translated
+                to its original index label when the profiler has labels
+            name (str): name of the row
+            zipcode (str): zip code of the row
+            stage (str): what decided the row, e.g. 'exact', 'cache' or 'fuzzy'
+            duplicate (bool): the decision
+            match (str, optional): name of the matched service. Defaults to None.
+            candidates (int, optional): number of candidates retrieved. Defaults to 0.
+            latency_ms (float, optional): candidate lookup time. Defaults to 0.0.
+            comparisons (int, optional): similarity computations. Defaults to 0.
+        """
+        if self._labels is not None:
+            row = self._labels[row]
+        self._append(row, name, zipcode, stage, duplicate, match, candidates, latency_ms, comparisons)
+
+    def record_exact(self, label, name, zipcode, match=None, key=None) -> None:
+        """Record a row resolved by an exact short circuit: a shared exact key
+           (stage 'exact_key') or the normalized name (stage 'exact').
+
+        Args:
+            label: index label of the row in the scraped DataFrame
+            name (str): name of the row
+            zipcode (str): zip code of the row
+            match (str, optional): name of the matched service. Defaults to name.
+            key (str, optional): the shared exact key, e.g. 'phone:+15035551234'.
+                Defaults to None, a normalized-name match.
+        """
+        self._append(
+            label, name, zipcode, 'exact_key' if key else 'exact', True,
+            name if match is None else match, key=key
+        )
+
+    def _append(self, label, name, zipcode, stage, duplicate, match=None,
+                candidates=0, latency_ms=0.0, comparisons=0, key=None) -> None:
+        entry = {
+            'row': _label(label),
+            'name': name,
+            'zip': _label(zipcode),
+            'stage': stage,
+            'duplicate': bool(duplicate),
+            'match': match if match is not False else None,
+            'key': key,
+            'candidates': int(candidates),
+            'latency_ms': round(float(latency_ms), 3),
+            'comparisons': int(comparisons),
+        }
+        self.rows.append(entry)
+        if self._trace is not None:
+            self._trace.write(json.dumps(entry, default=str) + '\n')
+
+    @staticmethod
+    def _histogram(values, buckets) -> list:
+        counts, _ = np.histogram(values, bins=buckets)
+        return [
+            (f'{low:g}-{high:g}' if np.isfinite(high) else f'>={low:g}', int(count))
+            for low, high, count in zip(buckets[:-1], buckets[1:], counts)
+        ]
+
+    def summary(self, slowest: int = 10) -> dict:
+        """Aggregate statistics of the recorded rows.
+
+        Returns:
+            dict: row counts per stage, duplicates, total similarity computations,
+            latency and candidate histograms, and the slowest rows
+        """
+        stages = {}
+        for entry in self.rows:
+            stages[entry['stage']] = stages.get(entry['stage'], 0) + 1
+        latencies = [e['latency_ms'] for e in self.rows]
+        return {
+            'rows': len(self.rows),
+            'stages': stages,
+            'duplicates': sum(e['duplicate'] for e in self.rows),
+            'comparisons': sum(e['comparisons'] for e in self.rows),
+            'latency_ms': self._histogram(latencies, LATENCY_BUCKETS_MS),
+            'candidates': self._histogram([e['candidates'] for e in self.rows], CANDIDATE_BUCKETS),
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if latencies else 0.0,
+            'slowest': sorted(self.rows, key=lambda e: -e['latency_ms'])[:slowest],
+        }
+
+    def log_summary(self) -> dict:
+        summary = self.summary()
+        logger.info(
+            f'dedup explain: {summary["rows"]} rows {summary["stages"]}, '
+            f'{summary["duplicates"]} duplicates, {summary["comparisons"]} similarity computations, '
+            f'lookup p50 {summary["latency_p50_ms"]:.2f}ms p99 {summary["latency_p99_ms"]:.2f}ms'
+        )
+        logger.info(f'dedup explain: lookup latency (ms) histogram {summary["latency_ms"]}')
+        logger.info(f'dedup explain: candidates per row histogram {summary["candidates"]}')
+        for entry in summary['slowest']:
+            logger.info(
+                f'dedup explain: slow row {entry["row"]} {entry["name"]!r} ({entry["zip"]}): '
+                f'{entry["latency_ms"]}ms, {entry["candidates"]} candidates'
+            )
+        return summary
+
+    def close(self) -> None:
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import numbers
+import re
+from urllib.parse import urlsplit
+
+from scourgify import normalize_address_record
+
+# Hosts shared by unrelated services, a match on them says nothing
+SHARED_DOMAINS = {
+    'facebook.com', 'google.com', 'instagram.com', 'twitter.com', 'linkedin.com',
+    'yelp.com', 'wix.com', 'wixsite.com', 'wordpress.com', 'blogspot.com',
+    'squarespace.com', 'weebly.com', 'linktr.ee', 'eventbrite.com', 'gmail.com',
+}
+# Public suffixes with two labels, so that the registrable domain keeps three
+TWO_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'gov.uk', 'ac.uk', 'com.au', 'org.au', 'gc.ca', 'on.ca',
+    'bc.ca', 'qc.ca', 'ab.ca', 'mb.ca', 'ns.ca', 'nb.ca', 'sk.ca',
+}
+EXTENSION_REGEX = re.compile(r'\s*(ext\.?|extension|x)\s*\d+\s*$', re.IGNORECASE)
+EMAIL_REGEX = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+# Fields of a service the exact keys are derived from
+SOURCE_FIELDS = ('phone', 'website', 'url', 'email', 'address1', 'address2', 'city', 'state', 'zip')
+
+
+def _text(value):
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value or None
+
+
+def normalize_phone(phone):
+    """E.164-style form of a phone number, assuming North America for 10 digits.
+
+    Args:
+        phone (str): e.g. '(503) 555-1234 ext. 5'
+
+    Returns:
+        str: e.g. '+15035551234', or None if it does not look like a phone number
+    """
+    phone = _text(phone)
+    if phone is None:
+        return None
+    digits = re.sub(r'\D', '', EXTENSION_REGEX.sub('', phone))
+    if len(digits) == 10:
+        return '+1' + digits
+    if len(digits) == 11 and digits.startswith('1'):
+        return '+' + digits
+    if phone.startswith('+') and 8 <= len(digits) <= 15:
+        return '+' + digits
+    return None
+
+
+def registrable_domain(url):
+    """The registrable domain of a website, e.g. 'https://www.oregonfoodbank.org/get-help'
+       -> 'oregonfoodbank.org'. Hosts of shared platforms such as facebook.com are ignored.
+
+    Args:
+        url (str): the website, with or without scheme
+
+    Returns:
+        str: the lowercased domain, or None
+    """
+    url = _text(url)
+    if url is None:
+        return None
+    if '//' not in url:
+        url = '//' + url
+    try:
+        host = (urlsplit(url).hostname or '').rstrip('.')
+    except ValueError:
+        return None
+    labels = [label for label in host.split('.') if label]
+    if len(labels) < 2:
+        return None
+    size = 3 if '.'.join(labels[-2:]) in TWO_LABEL_SUFFIXES else 2
+    domain = '.'.join(labels[-size:])
+    if domain in SHARED_DOMAINS or len(labels) < size:
+        return None
+    return domain
+
+
+def normalize_email(email):
+    email = _text(email)
+    if email is None or not EMAIL_REGEX.match(email):
+        return None
+    return email.lower()
+
+
+def address_hash(address1, city, state, zipcode, address2=None):
+    """Hash of the canonical form of a US street address, parsed and standardized
+       with usaddress/scourgify, so that '123 North Main Street' and '123 N Main St'
+       hash the same.
+
+    Returns:
+        str: 16 hex characters, or None if the address cannot be parsed
+    """
+    if isinstance(zipcode, numbers.Integral):
+        zipcode = str(zipcode).zfill(5)
+    parts = [_text(address1), _text(city), _text(state), _text(zipcode)]
+    if not all(parts):
+        return None
+    try:
+        canonical = normalize_address_record({
+            'address_line_1': parts[0], 'address_line_2': _text(address2),
+            'city': parts[1], 'state': parts[2], 'postal_code': parts[3],
+        })
+    except Exception:
+        return None
+    key = '|'.join(str(canonical.get(field) or '') for field in (
+        'address_line_1', 'address_line_2', 'city', 'state'
+    )) + '|' + str(canonical.get('postal_code') or '')[:5]
+    return hashlib.md5(key.upper().encode('utf-8')).hexdigest()[:16]
+
+
+def exact_keys(record):
+    """Exact dedup keys of a service: phone, website domain, email and address hash.
+
+    Args:
+        record (dict): a service document or DataFrame row
+
+    Returns:
+        list: sorted keys such as 'phone:+15035551234' or 'domain:oregonfoodbank.org'
+    """
+    keys = {
+        'phone': normalize_phone(record.get('phone')),
+        'domain': registrable_domain(record.get('website', record.get('url'))),
+        'email': normalize_email(record.get('email')),
+        'address': address_hash(
+            record.get('address1'), record.get('city'), record.get('state'),
+            record.get('zip'), record.get('address2')
+        ),
+    }
+    return sorted(f'{kind}:{value}' for kind, value in keys.items() if value)
+
+
+def exact_keys_hash(record):
+    """Hash of the SOURCE_FIELDS of a service, stored next to its exact keys so
+       that stale keys are detected when a phone, website, email or address changes.
+
+    Returns:
+        str: 16 hex characters
+    """
+    values = [record.get(field) for field in SOURCE_FIELDS]
+    text = '|'.join(
+        '' if v is None or (isinstance(v, float) and math.isnan(v)) else str(v) for v in values
+    )
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[:16]
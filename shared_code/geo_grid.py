@@ -0,0 +1,172 @@
+import logging
+import math
+from collections import defaultdict
+
+import numpy as np
+from tqdm import tqdm
+
+from shared_code.utils import normalize_name, batch_distance, zip_key, has_zip
+from shared_code.candidate_index import CandidateIndex
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def coordinates(document):
+    """The (lat, lon) of a service, read from lat/lon or latitude/longitude.
+
+    Args:
+        document (dict): a service document or DataFrame row
+
+    Returns:
+        tuple: (lat, lon) floats, or None if the service has no valid coordinates
+    """
+    lat = document.get('lat', document.get('latitude'))
+    lon = document.get('lon', document.get('longitude'))
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(lat) or math.isnan(lon) or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, np.asarray(lats), np.asarray(lons)))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class GeoGridIndex(CandidateIndex):
+    """Candidate index bucketing the services that have coordinates into grid
+       cells of cell_km, so that services within radius_km of an incoming row
+       are found by scanning only the neighbouring cells, across zip boundaries.
+
+       Few services carry coordinates, so the services of the row's zip, like
+       ZipGroupedCandidates, are always candidates too, and the only ones for
+       rows without coordinates. Candidates are scored with batch_distance on
+       the normalized names.
+    """
+
+    def __init__(self, radius_km: float = 1.0, cell_km: float = 1.0) -> None:
+        self.radius_km = radius_km
+        self._cell_degrees = cell_km / KM_PER_DEGREE
+        self._cells = defaultdict(list)
+        self._zips = defaultdict(list)
+        self._names = []
+        self._normalized = []
+        self._lats = []
+        self._lons = []
+
+    @classmethod
+    def from_collection(cls, client, collection, radius_km=1.0, cell_km=1.0):
+        """Build the index from the name, zip and coordinates of every service in a collection.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the db collection
+            radius_km (float, optional): search radius around a row. Defaults to 1.0.
+            cell_km (float, optional): height of a grid cell. Defaults to 1.0.
+
+        Returns:
+            GeoGridIndex: the populated index
+        """
+        index = cls(radius_km, cell_km)
+        projection = {'name': 1, 'zip': 1, 'lat': 1, 'lon': 1, 'latitude': 1, 'longitude': 1}
+        for document in tqdm(client[collection].find({}, projection)):
+            if document.get('name') is None:
+                continue
+            index.add(document['name'], document.get('zip'), coordinates(document))
+        logger.info(f'indexed {len(index)} services from {collection}, '
+                    f'{len(index._cells)} grid cells')
+        return index
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _cell(self, lat, lon) -> tuple:
+        return math.floor(lat / self._cell_degrees), math.floor(lon / self._cell_degrees)
+
+    def add(self, name, zipcode, point=None) -> None:
+        doc = len(self._names)
+        self._names.append(name)
+        self._normalized.append(normalize_name(str(name)))
+        self._lats.append(point[0] if point else np.nan)
+        self._lons.append(point[1] if point else np.nan)
+        self._zips[zip_key(zipcode)].append(doc)
+        if point:
+            self._cells[self._cell(*point)].append(doc)
+
+    def nearby(self, lat, lon) -> list:
+        """Services within radius_km of a point.
+
+        Returns:
+            list: positions of the services in the index
+        """
+        lat_span = self.radius_km / KM_PER_DEGREE
+        # a degree of longitude shrinks with the cosine of the latitude
+        lon_span = min(180.0, lat_span / max(math.cos(math.radians(lat)), 1e-6))
+        low, high = self._cell(lat - lat_span, lon - lon_span), self._cell(lat + lat_span, lon + lon_span)
+        docs = [
+            doc
+            for i in range(low[0], high[0] + 1)
+            for j in range(low[1], high[1] + 1)
+            for doc in self._cells.get((i, j), ())
+        ]
+        if not docs:
+            return []
+        distances = haversine_km(
+            lat, lon, [self._lats[d] for d in docs], [self._lons[d] for d in docs]
+        )
+        return [d for d, km in zip(docs, distances) if km <= self.radius_km]
+
+    def _best(self, name, docs):
+        if not docs:
+            return False
+        similarities = batch_distance(
+            normalize_name(str(name)), [self._normalized[d] for d in docs]
+        )
+        return self._names[docs[int(np.argmax(np.nan_to_num(similarities, nan=-np.inf)))]]
+
+    def neighbours(self, lat, lon, zipcode=None) -> list:
+        """Services within radius_km of a point, and the services of its zip.
+
+        Returns:
+            list: positions of the services in the index
+        """
+        docs = self.nearby(lat, lon)
+        if has_zip(zipcode):
+            docs = sorted(set(docs).union(self._zips.get(zip_key(zipcode), [])))
+        return docs
+
+    def lookup_nearby(self, name, lat, lon, zipcode=None) -> tuple:
+        """Most similar service within radius_km of a point or in the same zip,
+           and how many services were compared.
+
+        Returns:
+            tuple: (name of the service that might be a duplicate or False,
+            number of candidates)
+        """
+        docs = self.neighbours(lat, lon, zipcode)
+        return self._best(name, docs), len(docs)
+
+    def locate_nearby_duplicate(self, name, lat, lon, zipcode=None):
+        """Most similar service within radius_km of a point or in the same zip.
+
+        Returns:
+            str: name of the service that might be a duplicate, or False
+        """
+        return self.lookup_nearby(name, lat, lon, zipcode)[0]
+
+    def lookup(self, name, zipcode) -> tuple:
+        """Like lookup_nearby, for rows without coordinates.
+
+        Returns:
+            tuple: (name of the most similar service in the zip or False, number of candidates)
+        """
+        docs = self._zips.get(zip_key(zipcode), [])
+        return self._best(name, docs), len(docs)
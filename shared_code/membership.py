@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import numbers
+
+import numpy as np
+from bson import Binary
+from pymongo import ASCENDING, DESCENDING
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# 8 MB of hashes per document, well under the 16 MB BSON limit
+CHUNK_SIZE = 1000000
+# Incremental chunks are merged back into one sorted array beyond this
+MAX_CHUNKS = 16
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _key(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    # MongoDB matches 123 and 123.0, so they must hash the same
+    if isinstance(value, numbers.Real) and not isinstance(value, bool) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def hash_values(values):
+    """64-bit hashes of values, stable across processes and library versions.
+       Values whose text is the same, e.g. 123 and '123', hash the same.
+
+    Args:
+        values (iterable): values of a field, NaN and None are ignored
+
+    Returns:
+        np.ndarray: uint64 hashes, one per value that is not missing
+    """
+    return np.array([
+        int.from_bytes(hashlib.blake2b(_key(v).encode('utf-8'), digest_size=8).digest(), 'little')
+        for v in values if not _is_missing(v)
+    ], dtype=np.uint64)
+
+
+def collection_version(client, collection):
+    """Version marker of a collection that changes whenever services are added
+       or removed: document count and newest _id.
+    """
+    coll = client[collection]
+    newest = coll.find_one({}, {'_id': 1}, sort=[('_id', DESCENDING)])
+    return f'{coll.estimated_document_count()}:{newest["_id"] if newest else ""}'
+
+
+class ValueHashSet:
+    """Compact membership structure over the values of one field of a dump
+       collection, such as the EINs of tmpIRS: a sorted NumPy array of 64-bit
+       hashes of the values.
+
+       might_contain() has no false negatives, so a value it rejects is
+       definitely not in the collection and only the possible hits need to be
+       confirmed against MongoDB. Hash collisions only cause extra confirmations.
+
+       The array is persisted in the data-sources-membership collection, next to
+       data-sources, as chunks of binary hashes. Values added after loading are
+       saved as a new chunk, so an insert only writes its own hashes, and the
+       chunks are merged once there are more than MAX_CHUNKS. The set is tied
+       to the version of the collection it was saved for, and rebuilt from the
+       collection when anything else has changed it since.
+    """
+
+    def __init__(self, collection: str, field: str,
+                 store_collection: str = 'data-sources-membership') -> None:
+        self.collection = collection
+        self.field = field
+        self._store = store_collection
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._pending = np.empty(0, dtype=np.uint64)
+        self._chunks = 0
+
+    @classmethod
+    def build(cls, client, collection, field, **kwargs):
+        """Create the set from every value of the field in the collection and save it."""
+        values = cls(collection, field, **kwargs)
+        found = client[collection].find(
+            {field: {'$exists': True}}, {'_id': 0, field: 1}
+        )
+        values._hashes = np.unique(hash_values(d.get(field) for d in tqdm(found)))
+        values.save(client, compact=True)
+        logger.info(f'built membership set of {len(values)} {field} values of {collection}')
+        return values
+
+    @classmethod
+    def load(cls, client, collection, field, **kwargs):
+        """Read the saved set of a collection field, or build it if it is missing
+           or was saved for an older version of the collection.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the dump collection, e.g. 'tmpIRS'
+            field (str): name of the field, e.g. 'EIN'
+
+        Returns:
+            ValueHashSet: the set, in sync with the collection
+        """
+        values = cls(collection, field, **kwargs)
+        store = client[values._store]
+        store.create_index([('collection', ASCENDING), ('field', ASCENDING)])
+        chunks = list(store.find({'collection': collection, 'field': field}))
+        versions = {c.get('version') for c in chunks}
+        if not chunks or versions != {collection_version(client, collection)}:
+            logger.info(f'membership set of {collection}.{field} is missing or stale')
+            return cls.build(client, collection, field, **kwargs)
+        values._hashes = np.unique(np.concatenate([
+            np.frombuffer(c['hashes'], dtype=np.uint64) for c in chunks
+        ]))
+        values._chunks = len(chunks)
+        logger.info(f'loaded membership set of {len(values)} {field} values of {collection}')
+        return values
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, values) -> None:
+        """Add values that were inserted into the collection. They are only
+           persisted by the next save().
+        """
+        hashes = np.setdiff1d(hash_values(values), self._hashes)
+        self._hashes = np.union1d(self._hashes, hashes)
+        self._pending = np.union1d(self._pending, hashes)
+
+    def might_contain(self, values):
+        """Whether each value may be in the collection.
+
+        Args:
+            values (iterable): values to look up
+
+        Returns:
+            np.ndarray: bool mask, False where the value is definitely new or missing
+        """
+        values = list(values)
+        mask = np.zeros(len(values), dtype=bool)
+        present = [i for i, v in enumerate(values) if not _is_missing(v)]
+        if not present or len(self._hashes) == 0:
+            return mask
+        hashes = hash_values(values[i] for i in present)
+        positions = np.minimum(np.searchsorted(self._hashes, hashes), len(self._hashes) - 1)
+        mask[present] = self._hashes[positions] == hashes
+        return mask
+
+    def save(self, client, compact: bool = False) -> None:
+        """Persist the values added since loading as a new chunk, stamped with
+           the current version of the collection, so call it after inserting.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            compact (bool, optional): rewrite the whole set as sorted chunks.
+                Done anyway beyond MAX_CHUNKS. Defaults to False.
+        """
+        store = client[self._store]
+        selector = {'collection': self.collection, 'field': self.field}
+        version = collection_version(client, self.collection)
+        compact = compact or self._chunks + 1 > MAX_CHUNKS
+        if compact:
+            store.delete_many(selector)
+            hashes, self._chunks = self._hashes, 0
+        else:
+            store.update_many(selector, {'$set': {'version': version}})
+            hashes = self._pending
+        chunks = [
+            dict(selector, version=version, hashes=Binary(hashes[start:start + CHUNK_SIZE].tobytes()))
+            for start in range(0, len(hashes), CHUNK_SIZE)
+        ]
+        if compact and not chunks:
+            chunks = [dict(selector, version=version, hashes=Binary(b''))]
+        if chunks:
+            store.insert_many(chunks)
+            self._chunks += len(chunks)
+        self._pending = np.empty(0, dtype=np.uint64)
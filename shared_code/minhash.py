@@ -0,0 +1,175 @@
+import logging
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from pymongo import UpdateOne
+from tqdm import tqdm
+
+from shared_code.utils import normalize_name, has_zip
+from shared_code.candidate_index import CandidateIndex
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime 2**31 - 1 keeps a * x + b inside uint64 for the hash family
+_PRIME = (1 << 31) - 1
+_SEED = 1
+
+
+def shingles(name, size=3):
+    """Character shingles of the normalized service name.
+
+    Args:
+        name (str): the name of the service, e.g. 'FRIENDS OF LAKE HOPE'
+        size (int, optional): number of characters per shingle. Defaults to 3.
+
+    Returns:
+        set: set of shingle strings.
+    """
+    normalized = ' '.join(normalize_name(str(name)).split())
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+class MinHasher:
+    """Computes MinHash signatures of service names.
+
+       Shingles are hashed with crc32 and the permutations are drawn from a
+       fixed seed, so signatures are stable across runs and can be persisted.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3) -> None:
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(_SEED)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def _hash_shingles(self, name) -> list:
+        return [zlib.crc32(s.encode('utf-8')) % _PRIME for s in shingles(name, self.shingle_size)]
+
+    def signature(self, name) -> np.ndarray:
+        hashed = np.array(self._hash_shingles(name), dtype=np.uint64)
+        permuted = (np.outer(hashed, self._a) + self._b) % _PRIME
+        return permuted.min(axis=0).astype(np.int64)
+
+    def signatures(self, names) -> np.ndarray:
+        """Signatures of a batch of names, permuting all their shingles in one pass.
+
+        Returns:
+            np.ndarray: array of shape (len(names), num_perm)
+        """
+        if len(names) == 0:
+            return np.empty((0, self.num_perm), dtype=np.int64)
+        hashed = [self._hash_shingles(name) for name in names]
+        offsets = np.cumsum([0] + [len(h) for h in hashed[:-1]])
+        flat = np.fromiter((x for h in hashed for x in h), dtype=np.uint64)
+        permuted = (np.outer(flat, self._a) + self._b) % _PRIME
+        return np.minimum.reduceat(permuted, offsets, axis=0).astype(np.int64)
+
+
+class MinHashIndex(CandidateIndex):
+    """Near-duplicate candidate index bucketing MinHash signatures of service
+       names with LSH banding.
+
+       Lookups only touch the buckets the incoming name hashes to, so they are
+       sub-linear in the size of the collection and need no MongoDB text search.
+       Signatures are stored on the indexed documents in the minhash field, next
+       to the normalized name they were computed from, and only recomputed when
+       missing or stale.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16) -> None:
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+        self._hasher = MinHasher(num_perm)
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._buckets = defaultdict(list)
+        self._names = []
+        self._zips = []
+        self._signatures = []
+
+    @classmethod
+    def from_collection(cls, client, collection, num_perm=64, bands=16):
+        """Build the index from a collection, persisting any missing or stale signatures.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the db collection
+            num_perm (int, optional): signature length. Defaults to 64.
+            bands (int, optional): number of LSH bands. Defaults to 16.
+
+        Returns:
+            MinHashIndex: the populated index
+        """
+        index = cls(num_perm, bands)
+        coll = client[collection]
+        projection = {'_id': 1, 'name': 1, 'NAME': 1, 'zip': 1, 'minhash': 1, 'minhash_name': 1}
+        updates = []
+        for document in tqdm(coll.find({}, projection)):
+            name = document.get('name', document.get('NAME'))
+            if name is None:
+                continue
+            normalized = normalize_name(str(name))
+            signature = document.get('minhash')
+            if (signature is None or len(signature) != num_perm
+                    or document.get('minhash_name') != normalized):
+                signature = index.signature(name)
+                updates.append(UpdateOne(
+                    {'_id': document['_id']},
+                    {'$set': {'minhash': signature.tolist(), 'minhash_name': normalized}}
+                ))
+            index.add(name, document.get('zip'), signature)
+        if updates:
+            logger.info(f'persisting {len(updates)} minhash signatures in {collection}')
+            coll.bulk_write(updates, ordered=False)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def signature(self, name) -> np.ndarray:
+        return self._hasher.signature(name)
+
+    def _band_keys(self, signature):
+        for band in range(self._bands):
+            rows = signature[band * self._rows:(band + 1) * self._rows]
+            yield (band, tuple(int(r) for r in rows))
+
+    def add(self, name, zipcode, signature=None) -> None:
+        if signature is None:
+            signature = self.signature(name)
+        signature = np.asarray(signature, dtype=np.int64)
+        doc = len(self._names)
+        self._names.append(name)
+        self._zips.append(zipcode)
+        self._signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets[key].append(doc)
+
+    def candidates(self, name, zipcode) -> list:
+        """Services sharing at least one LSH bucket with name.
+
+        Args:
+            name (str): name of the service you want to add
+            zipcode (str): only services with this zip are returned, none when it is
+                missing, see shared_code.blocking for those rows
+
+        Returns:
+            list: (name, similarity) tuples, best estimated Jaccard similarity first
+        """
+        if not has_zip(zipcode):
+            return []
+        signature = self.signature(name)
+        docs = set()
+        for key in self._band_keys(signature):
+            docs.update(self._buckets.get(key, ()))
+        docs = [d for d in docs if str(self._zips[d]) == str(zipcode)]
+        ranked = sorted(
+            ((float(np.mean(self._signatures[d] == signature)), d) for d in docs),
+            key=lambda item: (-item[0], item[1])
+        )
+        return [(self._names[d], similarity) for similarity, d in ranked]
+
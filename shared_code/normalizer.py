@@ -0,0 +1,34 @@
+import re
+
+import pandas as pd
+
+# Saint/inc/nfp variants that should not count against similarity
+NAME_NOISE_REGEX = r'(st\.? |saint | inc\.?| nfp)'
+NAME_NOISE_PATTERN = re.compile(NAME_NOISE_REGEX)
+
+
+def normalize_name(name):
+    """Strip the saint/inc/nfp variants from a service name and lowercase it,
+       the form in which names are compared for similarity.
+
+    Args:
+        name (str): the name of the service, e.g. 'st dominics legal defense fund'
+
+    Returns:
+        str: the normalized name
+    """
+    return NAME_NOISE_PATTERN.sub('', name).lower()
+
+
+def normalize_names(names):
+    """Vectorized normalize_name over a whole column of names.
+
+    Args:
+        names (pd.Series or list): service names
+
+    Returns:
+        pd.Series: the normalized names, with the index of names
+    """
+    if not isinstance(names, pd.Series):
+        names = pd.Series(list(names), dtype=object)
+    return names.astype(str).str.replace(NAME_NOISE_PATTERN, '', regex=True).str.lower()
@@ -0,0 +1,181 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from shared_code.utils import normalize_name, batch_distance, check_similarity, zip_key
+
+logger = logging.getLogger(__name__)
+
+# Candidate store attached by each worker process in _attach_store
+_worker_store = None
+
+
+class SharedCandidateStore:
+    """Name and zip of every service of the check collection, laid out in flat
+       NumPy arrays that live in shared memory.
+
+       Services are sorted by zip, so a zip group is a contiguous slice found
+       with a binary search. Worker processes attach to the arrays by name
+       instead of receiving a pickled copy of the index with every task.
+    """
+
+    _FIELDS = ('zips', 'offsets', 'names')
+
+    def __init__(self, arrays, blocks=None) -> None:
+        self.zips = arrays['zips']
+        self.offsets = arrays['offsets']
+        self.names = arrays['names']
+        self._blocks = blocks or []
+
+    @classmethod
+    def from_collection(cls, client, collection):
+        """Copy the name and zip of every service of a collection into shared memory.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the collection
+
+        Returns:
+            SharedCandidateStore: the store, owning its shared memory blocks
+        """
+        services = sorted(
+            (zip_key(d.get('zip')), d['name'])
+            for d in client[collection].find({}, {'name': 1, 'zip': 1})
+            if d.get('name') is not None
+        )
+        encoded = [str(name).encode('utf-8') for _, name in services]
+        arrays = {
+            'zips': np.array([z.encode('utf-8') for z, _ in services], dtype=bytes),
+            'offsets': np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64),
+            'names': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        }
+        blocks, shared = [], {}
+        for field in cls._FIELDS:
+            array = arrays[field]
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared[field] = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[field][...] = array
+            blocks.append(block)
+        logger.info(f'copied {len(services)} services into shared memory')
+        return cls(shared, blocks)
+
+    @property
+    def descriptor(self) -> dict:
+        """Picklable description workers use to attach to the shared arrays."""
+        return {
+            field: (block.name, getattr(self, field).shape, getattr(self, field).dtype.str)
+            for field, block in zip(self._FIELDS, self._blocks)
+        }
+
+    @classmethod
+    def attach(cls, descriptor):
+        blocks, arrays = [], {}
+        for field, (name, shape, dtype) in descriptor.items():
+            block = shared_memory.SharedMemory(name=name)
+            arrays[field] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            blocks.append(block)
+        return cls(arrays, blocks)
+
+    def __len__(self) -> int:
+        return len(self.zips)
+
+    def close(self, unlink=False) -> None:
+        self.zips = self.offsets = self.names = None
+        for block in self._blocks:
+            block.close()
+            if unlink:
+                block.unlink()
+        self._blocks = []
+
+    def zip_group(self, zipcode) -> list:
+        key = zip_key(zipcode).encode('utf-8')
+        if len(key) > self.zips.dtype.itemsize:
+            return []
+        key = np.array(key, dtype=self.zips.dtype)
+        lo = np.searchsorted(self.zips, key, side='left')
+        hi = np.searchsorted(self.zips, key, side='right')
+        return [
+            bytes(self.names[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+            for i in range(lo, hi)
+        ]
+
+    def locate_potential_duplicate(self, name, zipcode):
+        """Drop-in for shared_code.utils.locate_potential_duplicate.
+
+        Returns:
+            str: name of the most similar service in the zip, or False
+        """
+        group = self.zip_group(zipcode)
+        if not group:
+            return False
+        similarities = batch_distance(normalize_name(str(name)), [normalize_name(n) for n in group])
+        return group[int(np.argmax(np.nan_to_num(similarities, nan=-np.inf)))]
+
+
+def _attach_store(descriptor):
+    global _worker_store
+    _worker_store = SharedCandidateStore.attach(descriptor)
+
+
+def _find_chunk_duplicates(rows):
+    decisions = []
+    for i, name, zipcode in rows:
+        dc = _worker_store.locate_potential_duplicate(name, zipcode)
+        decisions.append((i, dc, dc is not False and check_similarity(name, dc)))
+    return decisions
+
+
+def find_service_duplicates_parallel(df, client, collection, workers=4, cache=None,
+                                     chunks_per_worker=4, store=None):
+    """Parallel find_service_duplicates: the DataFrame is split into chunks that
+       are resolved by a process pool against a SharedCandidateStore.
+
+    Args:
+        df (pd.DataFrame): pre-processed data with name and zip columns
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection to check against
+        workers (int, optional): number of worker processes. Defaults to 4.
+        cache (DecisionCache, optional): decisions to reuse and record. Defaults to None.
+        chunks_per_worker (int, optional): chunks dispatched per worker. Defaults to 4.
+        store (SharedCandidateStore, optional): store to reuse instead of copying the
+            collection, left open for the caller to close. Defaults to None.
+
+    Returns:
+        list: index labels of the rows that are duplicates
+    """
+    has_zip = 'zip' in df.columns
+    found_duplicates = []
+    rows = []
+    for i in range(len(df)):
+        name = df.loc[i, 'name']
+        zipcode = df.loc[i, 'zip'] if has_zip else None
+        cached = cache.get(name, zipcode) if cache is not None else None
+        if cached is None:
+            rows.append((i, name, zipcode))
+        elif cached[0]:
+            found_duplicates.append(i)
+    if not rows:
+        return found_duplicates
+
+    owns_store = store is None
+    if owns_store:
+        store = SharedCandidateStore.from_collection(client, collection)
+    try:
+        size = -(-len(rows) // (workers * chunks_per_worker))
+        chunks = [rows[start:start + size] for start in range(0, len(rows), size)]
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_attach_store, initargs=(store.descriptor,)
+        ) as executor:
+            for decisions in tqdm(executor.map(_find_chunk_duplicates, chunks), total=len(chunks)):
+                for i, dc, duplicate in decisions:
+                    if duplicate:
+                        found_duplicates.append(i)
+                    if cache is not None:
+                        cache.put(df.loc[i, 'name'], df.loc[i, 'zip'] if has_zip else None, duplicate, dc)
+    finally:
+        if owns_store:
+            store.close(unlink=True)
+    return sorted(found_duplicates)
@@ -0,0 +1,64 @@
+import hashlib
+import math
+
+from shared_code.normalizer import normalize_name
+
+_SOUNDEX_GROUPS = ['AEIOUYHW', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R']
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(_SOUNDEX_GROUPS) for c in letters}
+# Fields of a service its blocking keys are stored and queried with
+SOURCE_FIELDS = ('city', 'state', 'zip')
+
+
+def soundex(token):
+    """American Soundex code of a word, e.g. 'PANTRY' and 'PANTREY' -> 'P536'.
+
+    Args:
+        token (str): a single word
+
+    Returns:
+        str: the four character code, or '' if the word has no letters A-Z
+    """
+    letters = [c for c in token.upper() if c in _SOUNDEX_CODES]
+    if not letters:
+        return ''
+    code = letters[0]
+    previous = _SOUNDEX_CODES[letters[0]]
+    for c in letters[1:]:
+        digit = _SOUNDEX_CODES[c]
+        if digit != '0' and digit != previous:
+            code += digit
+        # H and W do not separate letters with the same code, vowels do
+        if c not in 'HW':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def blocking_keys(name):
+    """Phonetic blocking keys of a service name: the Soundex code of every token
+       of the normalized name, plus all codes sorted into one whole-name key.
+       Tokens without letters, such as numbers, are kept as they are.
+
+    Args:
+        name (str): the name of the service, e.g. 'FRIENDS OF LAKE HOPE'
+
+    Returns:
+        list: sorted list of key strings
+    """
+    codes = [soundex(t) or t for t in normalize_name(str(name)).split()]
+    if not codes:
+        return []
+    return sorted(set(codes) | {' '.join(sorted(codes))})
+
+
+def blocking_keys_hash(record):
+    """Hash of the name and SOURCE_FIELDS of a service, stored next to its blocking
+       keys so that stale keys are detected when it is renamed or moved.
+
+    Returns:
+        str: 16 hex characters
+    """
+    values = [record.get('name', record.get('NAME'))] + [record.get(field) for field in SOURCE_FIELDS]
+    text = '|'.join(
+        '' if v is None or (isinstance(v, float) and math.isnan(v)) else str(v) for v in values
+    )
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from bson import ObjectId
+from tqdm import tqdm
+
+from shared_code.candidate_index import CandidateIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICA_PATH = os.path.join(tempfile.gettempdir(), 'services_replica.sqlite3')
+# Bumped whenever _SCHEMA changes, replicas of an older version are rebuilt
+SCHEMA_VERSION = 2
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS services (
+    rowid INTEGER PRIMARY KEY,
+    collection TEXT NOT NULL,
+    _id TEXT NOT NULL,
+    name TEXT,
+    zip TEXT,
+    city TEXT,
+    state TEXT,
+    UNIQUE (collection, _id)
+);
+CREATE INDEX IF NOT EXISTS services_zip ON services (collection, zip);
+CREATE VIRTUAL TABLE IF NOT EXISTS services_fts USING fts5(
+    name, content='services', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS services_ai AFTER INSERT ON services BEGIN
+    INSERT INTO services_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS services_ad AFTER DELETE ON services BEGIN
+    INSERT INTO services_fts (services_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS services_au AFTER UPDATE ON services BEGIN
+    INSERT INTO services_fts (services_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO services_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TABLE IF NOT EXISTS sync_state (
+    collection TEXT PRIMARY KEY,
+    updated_at TEXT,
+    last_id TEXT
+);
+'''
+
+
+def _text(value):
+    if value is None:
+        return None
+    return str(value)
+
+
+class ServicesReplica(CandidateIndex):
+    """Local SQLite FTS5 replica of the name, zip, city and state of the
+       services collection, used as an offline dedup backend.
+
+       sync() copies documents incrementally: only documents whose updatedAt is
+       past the stored watermark, or whose _id is past the last seen _id, are
+       fetched. Deletions in MongoDB are not seen by an incremental sync, run
+       sync(full=True) to rebuild the mirror of a collection from scratch.
+
+       Several collections can be mirrored in the same replica, every row
+       records the collection it was copied from. Candidates are looked up in
+       the collection the replica was opened for.
+    """
+
+    name_position = 1
+
+    def __init__(self, path: str = DEFAULT_REPLICA_PATH, collection: str = 'services') -> None:
+        self._path = path
+        self._collection = collection
+        self._conn = sqlite3.connect(path)
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._conn.executescript(
+                'DROP TABLE IF EXISTS services_fts; DROP TABLE IF EXISTS services; '
+                'DROP TABLE IF EXISTS sync_state;'
+            )
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @classmethod
+    def from_collection(cls, client, collection, path=None):
+        """Open the replica at path (or SERVICES_REPLICA_PATH) and bring it up to date.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str): name of the db collection to mirror
+            path (str, optional): SQLite database file. Defaults to None.
+
+        Returns:
+            ServicesReplica: the synced replica
+        """
+        replica = cls(
+            path or os.environ.get('SERVICES_REPLICA_PATH', DEFAULT_REPLICA_PATH), collection
+        )
+        replica.sync(client, collection)
+        return replica
+
+    def __len__(self) -> int:
+        return self._conn.execute(
+            'SELECT COUNT(*) FROM services WHERE collection = ?', (self._collection,)
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def watermarks(self, collection):
+        """Return the (updatedAt, _id) watermarks of the last sync of a collection."""
+        row = self._conn.execute(
+            'SELECT updated_at, last_id FROM sync_state WHERE collection = ?', (collection,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        updated_at = datetime.fromisoformat(row[0]) if row[0] else None
+        last_id = ObjectId(row[1]) if row[1] and ObjectId.is_valid(row[1]) else row[1]
+        return updated_at, last_id
+
+    def sync(self, client, collection='services', full=False) -> int:
+        """Mirror new and updated documents of a collection into the replica.
+
+        Args:
+            client (obj): pymongo MongoClient object
+            collection (str, optional): name of the db collection. Defaults to 'services'.
+            full (bool, optional): drop the mirrored rows of the collection and copy
+                everything. Defaults to False.
+
+        Returns:
+            int: number of documents copied
+        """
+        if full:
+            with self._conn:
+                self._conn.execute('DELETE FROM services WHERE collection = ?', (collection,))
+                self._conn.execute('DELETE FROM sync_state WHERE collection = ?', (collection,))
+        updated_at, last_id = self.watermarks(collection)
+        if last_id is None:
+            query = {}
+        elif updated_at is None:
+            query = {'$or': [{'_id': {'$gt': last_id}}, {'updatedAt': {'$exists': True}}]}
+        else:
+            query = {'$or': [{'_id': {'$gt': last_id}}, {'updatedAt': {'$gt': updated_at}}]}
+        projection = {'_id': 1, 'name': 1, 'NAME': 1, 'zip': 1, 'city': 1, 'state': 1, 'updatedAt': 1}
+
+        copied = 0
+        with self._conn:
+            for document in tqdm(client[collection].find(query, projection)):
+                self._conn.execute(
+                    'INSERT INTO services (collection, _id, name, zip, city, state) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(collection, _id) DO UPDATE SET name = excluded.name, '
+                    'zip = excluded.zip, city = excluded.city, state = excluded.state',
+                    (
+                        collection,
+                        str(document['_id']),
+                        _text(document.get('name', document.get('NAME'))),
+                        _text(document.get('zip')),
+                        _text(document.get('city')),
+                        _text(document.get('state')),
+                    )
+                )
+                copied += 1
+                document_updated_at = document.get('updatedAt')
+                if isinstance(document_updated_at, datetime) and (
+                        updated_at is None or document_updated_at > updated_at):
+                    updated_at = document_updated_at
+                if last_id is None or document['_id'] > last_id:
+                    last_id = document['_id']
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_state (collection, updated_at, last_id) VALUES (?, ?, ?)',
+                (collection, updated_at.isoformat() if updated_at else None, _text(last_id))
+            )
+        logger.info(f'synced {copied} documents from {collection} into {self._path}')
+        return copied
+
+    def candidates(self, name, zipcode, limit=10) -> list:
+        """Services in the same zip sharing at least one word with name.
+
+        Args:
+            name (str): name of the service you want to add
+            zipcode (str): zip code of the service you want to add
+            limit (int, optional): maximum number of candidates. Defaults to 10.
+
+        Returns:
+            list: (_id, name) tuples, best bm25 rank first
+        """
+        words = set(re.findall(r'\w+', str(name).lower()))
+        if not words:
+            return []
+        match = ' OR '.join('"' + w + '"' for w in sorted(words))
+        return self._conn.execute(
+            'SELECT s._id, s.name FROM services_fts JOIN services s ON s.rowid = services_fts.rowid '
+            'WHERE services_fts MATCH ? AND s.collection = ? AND s.zip = ? '
+            'ORDER BY services_fts.rank LIMIT ?',
+            (match, self._collection, _text(zipcode), limit)
+        ).fetchall()
@@ -1,13 +1,22 @@
+import hashlib
 import logging
 import os
 from collections import OrderedDict
 
-from pymongo import MongoClient, TEXT
+from pymongo import MongoClient, TEXT, ASCENDING, UpdateOne
 from tqdm import tqdm
 import re
 import urllib
+import zlib
 import numpy as np
 
+from shared_code.normalizer import normalize_name
+from shared_code.phonetic import blocking_keys, blocking_keys_hash, SOURCE_FIELDS as BLOCKING_SOURCE_FIELDS
+from shared_code.exact_keys import exact_keys, exact_keys_hash, SOURCE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
 def get_mongo_client(arg1=None, arg2=None):
     db_name = 'shelter'
     if arg1 and arg2:
@@ -26,25 +35,78 @@ def get_mongo_client(arg1=None, arg2=None):
         + os.environ["PW"] 
         + "@shelter-rm3lc.azure.mongodb.net/shelter?retryWrites=true&w=majority")[db_name]
     
-def insert_services(data, client, collection):
+def insert_services(data, client, collection, enrich=None):
     """Intake scraped services that have been processed and dupe-checked, and add to MongoDB.
 
     Args:
         data (dict): dictionary of IRS services containing ID, name, location and NTEE code
         client (obj): MongoClient object
         collection (str): the Mongo collection in which the data should be inserted
+        enrich (function, optional): hook called with the whole batch of records before
+            it is written, e.g. shared_code.dedup.enrich_services. Defaults to None.
     """
     db = client
     db_coll = db[collection]
     if len(data) > 0:
+        if enrich is not None:
+            data = enrich(data)
         db_coll.insert_many(data)
 
 
-def check_similarity(new_service, existing_service):
-    regex = r'(st\.? |saint | inc\.?| nfp)'
-    new_subbed_service = re.sub(regex, '', new_service).lower()
-    existing_subbed_service = re.sub(regex, '', existing_service).lower()
-    return distance(new_subbed_service, existing_subbed_service) >= 0.9
+def zip_key(zipcode):
+    """Text key of a zip code, so that 97211 and '97211' land together."""
+    if isinstance(zipcode, np.integer):
+        zipcode = int(zipcode)
+    return str(zipcode)
+
+
+def has_zip(zipcode):
+    """Whether a zip value is usable for blocking, i.e. not None, NaN or empty."""
+    if zipcode is None:
+        return False
+    if isinstance(zipcode, float) and np.isnan(zipcode):
+        return False
+    return str(zipcode).strip().lower() not in ('', 'nan', 'none')
+
+
+def find_existing_values(client, collection, field, values, chunk_size=1000):
+    """Which of a set of values are already stored in a field of a collection,
+       queried with $in over chunks of distinct values instead of once per value.
+       Ensures the field is indexed.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        field (str): name of the field, e.g. 'name'
+        values (iterable): values to look up, NaN and None are ignored
+        chunk_size (int, optional): number of values per query. Defaults to 1000.
+
+    Returns:
+        set: the values that exist in the collection
+    """
+    coll = client[collection]
+    if f'{field}_1' not in coll.index_information().keys():
+        coll.create_index([(field, ASCENDING)])
+    distinct = list({
+        v.item() if isinstance(v, np.generic) else v
+        for v in values
+        if v is not None and not (isinstance(v, float) and np.isnan(v))
+    })
+    existing = set()
+    for start in range(0, len(distinct), chunk_size):
+        found = coll.find(
+            {field: {"$in": distinct[start:start + chunk_size]}}, {"_id": 0, field: 1}
+        )
+        existing.update(d[field] for d in found if field in d)
+    return existing
+
+
+def check_similarity(new_service, existing_service, threshold=0.9):
+    new_subbed_service = normalize_name(new_service)
+    existing_subbed_service = normalize_name(existing_service)
+    return bounded_distance(
+        new_subbed_service, existing_subbed_service, threshold
+    ) is not None
 
 
 def make_ngrams(name, min_size=7):
@@ -66,61 +128,524 @@ def make_ngrams(name, min_size=7):
     ))
 
 
-def refresh_ngrams(client, collection):
-    """Make sure all the services in the desired collection have an ngram field.
-       Also ensures that the n-gram field is included
-       in the text index for the purpose of searching.
+def ngram_terms(name, min_size=7):
+    """Whitespace-separated terms of ' '.join(make_ngrams(name)), i.e. the
+       terms a $text search on the ngrams field matches on, computed without
+       materializing the n-grams.
+
+       Every word is a term, plus the word suffixes and prefixes that an n-gram
+       boundary can cut, plus inner substrings of at least min_size characters.
+
+    Args:
+        name (str): the name of the service, e.g. 'FRIENDS OF LAKE HOPE'
+        min_size (int, optional): the minimum number of characters in one ngram. Defaults to 7.
+
+    Returns:
+        set: set of term strings.
+    """
+    length = len(name)
+    terms = set()
+    for match in re.finditer(r'\S+', name):
+        word, start, end = match.group(), match.start(), match.end()
+        terms.add(word)
+        for k in range(1, len(word)):
+            if length - (start + k) >= min_size:
+                terms.add(word[k:])  # n-gram starting inside the word
+            if start + k >= min_size:
+                terms.add(word[:k])  # n-gram ending inside the word
+        for i in range(1, len(word)):
+            for j in range(i + min_size, len(word)):
+                terms.add(word[i:j])
+    return terms
+
+
+def name_hash(name, upper=True):
+    """Short stable hash of a service name, stored next to derived fields so
+       that stale values can be detected when the name changes. Pass upper=False
+       for fields that depend on the case of the name, such as normalized_name.
+    """
+    name = str(name).upper() if upper else str(name)
+    return hashlib.md5(name.encode('utf-8')).hexdigest()[:16]
+
+
+def refresh_ngrams(client, collection, batch_size=1000, checkpoint_collection='refresh-checkpoints'):
+    """Make sure all the services in the desired collection have an up to date ngram
+       and normalized_name field. Also ensures that the n-gram field is included
+       in the text index for the purpose of searching, and that the compound
+       (zip, normalized_name) index used for exact normalized matches exists.
+
+       Only documents whose ngrams or normalized_name are missing, or whose name
+       changed since they were computed (tracked with the ngrams_hash and
+       normalized_name_hash fields), are updated, in bulk_write batches, so both
+       fields cost a single pass over the collection. The last _id of every
+       flushed batch is checkpointed, so an interrupted refresh resumes where it stopped.
 
     Args:
         client (obj): pymongo MongoClient object
         collection (str): name of the collection in the db
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+        checkpoint_collection (str, optional): collection holding resume checkpoints.
+            Defaults to 'refresh-checkpoints'.
+
+    Returns:
+        int: number of documents updated
     """
     coll = client[collection]
-    for document in tqdm(coll.find()):
-        try:
-            coll.update_one(
-                {"_id": document["_id"]},
-                {"$set": {
-                    "ngrams": ' '.join(make_ngrams(document["name"].upper()))
-                }
-                }
-            )
-        except KeyError:
-            coll.update_one(
-                {"_id": document["_id"]},
-                {"$set": {
-                    "ngrams": ' '.join(make_ngrams(document["NAME"].upper()))
-                }
-                }
-            )
+    checkpoints = client[checkpoint_collection]
+    checkpoint_key = {"collection": collection, "field": "ngrams"}
+    checkpoint = checkpoints.find_one(checkpoint_key)
+    query = {}
+    if checkpoint is not None:
+        logger.info(f'resuming ngram refresh of {collection} after {checkpoint["last_id"]}')
+        query = {"_id": {"$gt": checkpoint["last_id"]}}
+
+    updates = []
+    updated = 0
+    last_id = None
+    # ngrams_hash is only ever written together with ngrams, so the (large)
+    # ngrams field itself does not need to be fetched
+    projection = {"name": 1, "NAME": 1, "ngrams_hash": 1, "normalized_name_hash": 1}
+    cursor = coll.find(query, projection).sort("_id", ASCENDING)
+    for document in tqdm(cursor):
+        last_id = document["_id"]
+        name = document.get("name", document.get("NAME"))
+        if name is None:
+            continue
+        fields = _normalized_name_fields(document) or {}
+        digest = name_hash(name)
+        if document.get("ngrams_hash") != digest:
+            fields["ngrams"] = ' '.join(make_ngrams(str(name).upper()))
+            fields["ngrams_hash"] = digest
+        if not fields:
+            continue
+        updates.append(UpdateOne({"_id": document["_id"]}, {"$set": fields}))
+        if len(updates) >= batch_size:
+            coll.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+            checkpoints.update_one(checkpoint_key, {"$set": {"last_id": last_id}}, upsert=True)
+    if updates:
+        coll.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    checkpoints.delete_one(checkpoint_key)
     # Check that ngram field is indexed
-    if 'ngrams_text' not in coll.index_information().keys():
+    indexes = coll.index_information().keys()
+    if 'ngrams_text' not in indexes:
         coll.create_index([("ngrams", TEXT)])
+    if 'zip_1_normalized_name_1' not in indexes:
+        coll.create_index([("zip", ASCENDING), ("normalized_name", ASCENDING)])
+    return updated
+
+
+def make_qgrams(name, q=3):
+    """Convert service name into the compact q-gram representation:
+       sorted, de-duplicated 31-bit crc32 ids of its q-character substrings.
+
+       Unlike make_ngrams this is linear in the length of the name, and the
+       ids can be stored in an integer array with a regular multikey index.
+
+    Args:
+        name (str): the name of the service, e.g. 'FRIENDS OF LAKE HOPE'
+        q (int, optional): number of characters per q-gram. Defaults to 3.
+
+    Returns:
+        list: sorted list of int q-gram ids.
+    """
+    name = ' '.join(str(name).upper().split())
+    grams = [name[i:i + q] for i in range(max(1, len(name) - q + 1))]
+    return sorted({zlib.crc32(g.encode('utf-8')) & 0x7fffffff for g in grams})
+
+
+def _refresh_field(coll, query, projection, compute, batch_size=1000):
+    """Store derived fields on the documents of a collection, in bulk_write batches.
+
+    Args:
+        coll (obj): pymongo Collection
+        query (dict): filter of the documents to check
+        projection (dict): the fields compute reads
+        compute (function): called with every document, returns the fields to
+            $set on it, or None to leave it as it is
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    updates = []
+    updated = 0
+    for document in tqdm(coll.find(query, projection)):
+        fields = compute(document)
+        if fields is None:
+            continue
+        updates.append(UpdateOne({"_id": document["_id"]}, {"$set": fields}))
+        if len(updates) >= batch_size:
+            coll.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+    if updates:
+        coll.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    return updated
+
+
+def _from_name(field, make):
+    """_refresh_field compute function setting field to make(name), and field_hash
+       to the name_hash of the name, on named services whose hash differs.
+    """
+    def compute(document):
+        name = document.get("name", document.get("NAME"))
+        if name is None:
+            return None
+        digest = name_hash(name)
+        if document.get(f"{field}_hash") == digest:
+            return None
+        return {field: make(name), f"{field}_hash": digest}
+    return compute
+
+
+def refresh_qgrams(client, collection, batch_size=1000):
+    """Store the qgrams field of the services in the collection, and ensure the
+       (zip, qgrams) index used to query it exists.
+
+       Only documents whose qgrams are missing, or whose name changed since they
+       were computed (tracked with the qgrams_hash field), are updated.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = client[collection]
+    updated = _refresh_field(
+        coll, {}, {"name": 1, "NAME": 1, "qgrams_hash": 1},
+        _from_name("qgrams", make_qgrams), batch_size
+    )
+    if 'zip_1_qgrams_1' not in coll.index_information().keys():
+        coll.create_index([("zip", ASCENDING), ("qgrams", ASCENDING)])
+    return updated
+
+
+def _blocking_key_fields(document):
+    name = document.get("name", document.get("NAME"))
+    if name is None:
+        return None
+    digest = blocking_keys_hash(document)
+    if document.get("blocking_keys_hash") == digest:
+        return None
+    return {"blocking_keys": blocking_keys(name), "blocking_keys_hash": digest}
+
+
+def refresh_blocking_keys(client, collection, batch_size=1000):
+    """Store the phonetic blocking_keys field of the services in the collection,
+       and ensure the (zip, blocking_keys) index used to query it exists.
+
+       Only documents whose keys are missing, or whose name, city, state or zip
+       changed since they were computed (tracked with the blocking_keys_hash
+       field), are updated.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = client[collection]
+    projection = dict.fromkeys(("name", "NAME", "blocking_keys_hash") + BLOCKING_SOURCE_FIELDS, 1)
+    updated = _refresh_field(coll, {}, projection, _blocking_key_fields, batch_size)
+    if 'zip_1_blocking_keys_1' not in coll.index_information().keys():
+        coll.create_index([("zip", ASCENDING), ("blocking_keys", ASCENDING)])
+    return updated
+
+
+def _exact_key_fields(document):
+    digest = exact_keys_hash(document)
+    if document.get("exact_keys_hash") == digest:
+        return None
+    return {"exact_keys": exact_keys(document), "exact_keys_hash": digest}
+
+
+def refresh_exact_keys(client, collection, batch_size=1000):
+    """Store the exact_keys field (phone, website domain, email and address hash, see
+       shared_code.exact_keys) of the services in the collection, and ensure the
+       (zip, exact_keys) index used to query it exists.
+
+       Only documents whose keys are missing, or whose phone, website, email or
+       address changed since they were computed (tracked with the exact_keys_hash
+       field), are updated.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = client[collection]
+    projection = dict.fromkeys(SOURCE_FIELDS + ("exact_keys_hash",), 1)
+    updated = _refresh_field(coll, {}, projection, _exact_key_fields, batch_size)
+    if 'zip_1_exact_keys_1' not in coll.index_information().keys():
+        coll.create_index([("zip", ASCENDING), ("exact_keys", ASCENDING)])
+    return updated
+
+
+def _normalized_name_fields(document):
+    name = document.get("name", document.get("NAME"))
+    if name is None:
+        return None
+    digest = name_hash(name, upper=False)
+    if document.get("normalized_name_hash") == digest:
+        return None
+    return {"normalized_name": normalize_name(str(name)), "normalized_name_hash": digest}
+
+
+def refresh_normalized_names(client, collection, batch_size=1000):
+    """Store the normalized_name of the services in the collection, and ensure the
+       compound (zip, normalized_name) index used for exact normalized matches exists.
+
+       Like refresh_ngrams, only documents whose normalized_name is missing, or whose
+       name changed since it was computed (tracked with the normalized_name_hash
+       field), are updated, streamed in bulk_write batches. refresh_ngrams already
+       does this in its own pass, so this is for the engines that skip it.
+
+    Args:
+        client (obj): pymongo MongoClient object
+        collection (str): name of the collection in the db
+        batch_size (int, optional): number of updates per bulk_write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = client[collection]
+    updated = _refresh_field(
+        coll, {}, {"name": 1, "NAME": 1, "normalized_name_hash": 1},
+        _normalized_name_fields, batch_size
+    )
+    if 'zip_1_normalized_name_1' not in coll.index_information().keys():
+        coll.create_index([("zip", ASCENDING), ("normalized_name", ASCENDING)])
+    return updated
+
+
+def _myers_edit_distance(a, b):
+    """Bit-parallel (Myers/Hyyrö) Levenshtein distance between a and b.
+
+    The columns of the DP matrix are encoded as vertical delta bit-vectors
+    over the characters of a, so each character of b costs a handful of
+    integer operations instead of a row of len(a) cells. Python ints are
+    arbitrary precision, so there is no 64 character limit on a.
+
+    Args:
+        a (str): pattern string, should be the shorter one
+        b (str): text string
+
+    Returns:
+        int: the edit distance between a and b
+    """
+    n = len(a)
+    if n == 0:
+        return len(b)
+    peq = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << n) - 1
+    last = 1 << (n - 1)
+    pv, mv, score = mask, 0, n
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
 
 
 def distance(a, b):
-    """ Calculates the Levenshtein distance between a and b.
+    """ Calculates the Levenshtein similarity between a and b, i.e.
+        1 - (edit distance / length of the shorter string).
     """
     n, m = len(a), len(b)
     if n > m:
-        # Make sure n <= m, to use O(min(n,m)) space
         a, b = b, a
         n, m = m, n
 
-    current = range(n + 1)
+    return 1 - (_myers_edit_distance(a, b) / len(a))
+
+
+BATCH_DISTANCE_MIN_SIZE = 64
+
+
+def batch_distance(name, candidates):
+    """Calculates the Levenshtein similarity between one service name and
+       many candidate names in a single NumPy-vectorized pass.
+
+       The bit-parallel recurrence of _myers_edit_distance is run with name
+       as the pattern, one candidate per array lane, stepping over candidate
+       positions. Names up to 64 characters use uint64 lanes, longer ones
+       fall back to object arrays of Python ints.
+
+    Args:
+        name (str): the name of the incoming service
+        candidates (list): candidate names to compare against
+
+    Returns:
+        np.ndarray: float array of similarities, the same as calling
+        distance(name, c) for every candidate c. Pairs where the shorter
+        string is empty are nan.
+    """
+    candidates = [str(c) for c in candidates]
+    n = len(name)
+    lengths = np.array([len(c) for c in candidates], dtype=np.int64)
+    if len(candidates) == 0:
+        return np.empty(0, dtype=float)
+    if len(candidates) < BATCH_DISTANCE_MIN_SIZE:
+        # Below this size the per-step NumPy overhead outweighs the vectorization
+        scores = np.array([
+            _myers_edit_distance(*((name, c) if n <= len(c) else (c, name))) for c in candidates
+        ], dtype=np.int64)
+        return _similarities(scores, lengths, n)
+
+    scores = lengths.copy()
+    if n > 0:
+        width = int(lengths.max())
+        codes = np.full((len(candidates), max(width, 1)), -1, dtype=np.int64)
+        for row, c in enumerate(candidates):
+            codes[row, :len(c)] = np.frombuffer(c.encode('utf-32-le'), dtype=np.uint32)
+
+        if n <= 64:
+            dtype, word = np.uint64, np.uint64
+        else:
+            dtype, word = object, int
+        peq = {}
+        for i, c in enumerate(name):
+            peq[ord(c)] = peq.get(ord(c), 0) | (1 << i)
+        alphabet = np.array(sorted(peq), dtype=np.int64)
+        # Last slot holds the empty bit-vector for characters not in name
+        eq_table = np.array([peq[c] for c in alphabet] + [0], dtype=dtype)
+
+        mask, last, one = word((1 << n) - 1), word(1 << (n - 1)), word(1)
+        pv = np.full(len(candidates), mask, dtype=dtype)
+        mv = np.full(len(candidates), word(0), dtype=dtype)
+        scores[:] = n
+        for pos in range(width):
+            active = lengths > pos
+            column = codes[:, pos]
+            slot = np.minimum(np.searchsorted(alphabet, column), len(alphabet) - 1)
+            eq = eq_table[np.where(alphabet[slot] == column, slot, len(alphabet))]
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = (mv | ~(xh | pv)) & mask
+            mh = pv & xh
+            up = (ph & last) != 0
+            down = ~up & ((mh & last) != 0)
+            scores += active & up
+            scores -= active & down
+            ph = ((ph << one) | one) & mask
+            mh = (mh << one) & mask
+            pv = np.where(active, (mh | ~(xv | ph)) & mask, pv)
+            mv = np.where(active, ph & xv & mask, mv)
+    return _similarities(scores, lengths, n)
+
+
+def _similarities(scores, lengths, n):
+    shorter = np.minimum(lengths, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = 1 - (scores / shorter)
+    similarity[shorter == 0] = np.nan
+    return similarity
+
+
+def max_edits(length, threshold=0.9):
+    """Largest edit distance k that still satisfies 1 - k / length >= threshold,
+       i.e. the edit budget of a pair whose shorter string has this length.
+
+    Args:
+        length (int): length of the shorter string
+        threshold (float, optional): minimum similarity. Defaults to 0.9.
+
+    Returns:
+        int: the edit budget, or -1 if even identical strings fall short
+    """
+    if length == 0:
+        return -1
+    k = int((1 - threshold) * length)
+    while k < length and 1 - ((k + 1) / length) >= threshold:
+        k += 1
+    while k >= 0 and 1 - (k / length) < threshold:
+        k -= 1
+    return k
+
+
+def bounded_distance(a, b, threshold=0.9):
+    """Calculates the Levenshtein similarity between a and b like distance(),
+       but gives up as soon as the similarity can no longer reach threshold.
+
+       Pairs whose length difference alone exceeds the allowed number of edits
+       are rejected without any DP. Otherwise only the diagonal band of the DP
+       matrix that the threshold allows is computed, and the computation stops
+       as soon as the minimum of a row's band exceeds the limit.
+
+    Args:
+        a (str): first string
+        b (str): second string
+        threshold (float, optional): minimum similarity. Defaults to 0.9.
+
+    Returns:
+        float: the similarity, or None if it is below threshold.
+    """
+    n, m = len(a), len(b)
+    if n > m:
+        a, b = b, a
+        n, m = m, n
+    if n == 0:
+        return None
+
+    k = max_edits(n, threshold)
+    if k < 0 or m - n > k:
+        return None
+
+    inf = k + 1
+    previous = [j if j <= k else inf for j in range(n + 1)]
+    current = [inf] * (n + 1)
     for i in range(1, m + 1):
-        previous, current = current, [i] + [0] * n
-        for j in range(1, n + 1):
+        lo, hi = max(1, i - k), min(n, i + k)
+        current[lo - 1] = i if lo == 1 else inf
+        row_min = current[lo - 1]
+        c = b[i - 1]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (a[j - 1] != c)
             add, delete = previous[j] + 1, current[j - 1] + 1
-            change = previous[j - 1]
-            if a[j - 1] != b[i - 1]:
-                change = change + 1
-            current[j] = min(add, delete, change)
+            if add < cost:
+                cost = add
+            if delete < cost:
+                cost = delete
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > k:
+            return None
+        if hi < n:
+            current[hi + 1] = inf
+        previous, current = current, previous
 
-    return 1 - (current[n] / len(a))
+    similarity = 1 - (previous[n] / n)
+    if similarity < threshold:
+        return None
+    return similarity
 
 
-def locate_potential_duplicate(name, zipcode, client, collection):
+def locate_potential_duplicate(name, zipcode, client, collection, index=None):
     """Search the desired db collection for services that might be
        fuzzy dupes of the service you're looking to add.
 
@@ -129,10 +654,14 @@ def locate_potential_duplicate(name, zipcode, client, collection):
         zipcode (str): string of the zip code of the service you want to add
         client (obj): pymongo MongoClient object
         collection (str): name of the db collection
+        index (obj, optional): an in-process candidate index, e.g. a
+            shared_code.dedup.NgramIndex, to query instead of MongoDB. Defaults to None.
 
     Returns:
         str: name of the service that might be a duplicate
     """
+    if index is not None:
+        return index.locate_potential_duplicate(name, zipcode)
 
     if isinstance(zipcode, np.integer):
         zipcode = int(zipcode)
@@ -145,3 +674,28 @@ def locate_potential_duplicate(name, zipcode, client, collection):
     if dupe_candidate is not None:
         return dupe_candidate["name"]
     return False
+
+
+def locate_potential_duplicates(name, zipcode, client, collection, limit=10):
+    """Like locate_potential_duplicate, but returns the limit best text search
+       matches, ranked by textScore, instead of whichever match is found first.
+
+    Args:
+        name (str): name of the service you want to add
+        zipcode (str): string of the zip code of the service you want to add
+        client (obj): pymongo MongoClient object
+        collection (str): name of the db collection
+        limit (int, optional): number of candidates to return. Defaults to 10.
+
+    Returns:
+        list: names of the services that might be duplicates, best match first
+    """
+    if isinstance(zipcode, np.integer):
+        zipcode = int(zipcode)
+
+    grammed_name = make_ngrams(name)
+    cursor = client[collection].find(
+        {"$text": {"$search": ' '.join(grammed_name)}, 'zip': zipcode},
+        {"name": 1, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    return [d["name"] for d in cursor]
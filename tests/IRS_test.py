@@ -7,7 +7,8 @@ from pymongo import MongoClient, TEXT
 from IRS import irs_scraper
 from shared_code.utils import (
     make_ngrams, distance, insert_services, check_similarity,
-    locate_potential_duplicate, refresh_ngrams, get_mongo_client
+    locate_potential_duplicate, refresh_ngrams, get_mongo_client,
+    bounded_distance, batch_distance, locate_potential_duplicates
 )
 
 
@@ -312,6 +313,33 @@ def test_distance():
     assert round(distance('trench', 'wrench'), 3) == 0.833
 
 
+def test_distance_is_symmetric():
+    assert distance('st feriole island park', 'saint feriole island park') == \
+        distance('saint feriole island park', 'st feriole island park')
+
+
+def test_distance_longer_than_word_size():
+    name = 'catholic charities of the archdiocese of san francisco family services'
+    assert len(name) > 64
+    assert round(distance(name, name.replace('family', 'famly')), 3) == 0.986
+
+
+def test_bounded_distance_matches_distance_above_threshold():
+    assert bounded_distance('trench', 'wrench', 0.8) == distance('trench', 'wrench')
+
+
+def test_bounded_distance_rejects_below_threshold():
+    assert bounded_distance('trench', 'wrench', 0.9) is None
+    assert bounded_distance('food bank', 'oregon food bank of portland') is None
+
+
+def test_batch_distance_matches_distance():
+    candidates = ['wrench', 'trench', 'french fries', 'bench'] * 20
+    similarities = batch_distance('trench', candidates)
+    assert list(similarities) == [distance('trench', c) for c in candidates]
+    assert list(batch_distance('trench', candidates[:4])) == list(similarities[:4])
+
+
 def test_mock_collection_instantiation(example_IRS_service_data, mock_mongo_client):
     mock_services = mock_mongo_client.db.mock_services
     for obj in example_IRS_service_data:
@@ -360,3 +388,20 @@ def test_fuzzy_match(
     )
     client.drop_collection('pytest_fuzzy_test')
     assert dc == 'ST FERIOLE ISLAND PARK'
+
+
+@pytest.mark.realclient
+def test_locate_potential_duplicates_ranks_by_text_score(example_IRS_service_data):
+    client = get_mongo_client()
+    if 'pytest_fuzzy_test' in client.list_collection_names():
+        client.drop_collection('pytest_fuzzy_test')
+    client.create_collection('pytest_fuzzy_test')
+    insert_services(example_IRS_service_data, client, 'pytest_fuzzy_test')
+    refresh_ngrams(client, 'pytest_fuzzy_test')
+    service = example_IRS_service_data[0]
+    candidates = locate_potential_duplicates(
+        service['name'], service['zip'], client, 'pytest_fuzzy_test', limit=3
+    )
+    client.drop_collection('pytest_fuzzy_test')
+    assert candidates[0] == service['name']
+    assert len(candidates) <= 3
@@ -0,0 +1,854 @@
+import datetime
+import json
+
+import pandas as pd
+import pytest
+import mongomock
+
+from shared_code.utils import (
+    insert_services, locate_potential_duplicate, make_qgrams, refresh_qgrams,
+    make_ngrams, refresh_ngrams, normalize_name, refresh_normalized_names, bounded_distance,
+    refresh_exact_keys, find_existing_values, refresh_blocking_keys
+)
+from shared_code.normalizer import normalize_names
+from shared_code.dedup import (
+    NgramIndex, ZipGroupedCandidates, QgramIndex, build_dedup_index, enrich_services,
+    find_service_duplicates, find_exact_normalized_duplicates, check_service_duplicates,
+    find_intra_batch_duplicates, CrossSourceIndex, dump_collections, find_cross_source_duplicates,
+    PhoneticIndex, resolve_service_matches, find_exact_key_duplicates, validate_dedup_options,
+    DEDUP_INDEXES
+)
+from shared_code.blocking import (
+    BlockingStrategy, CityStateBlocking, StateNamePrefixBlocking, refresh_blocking_fields,
+    locate_blocked_duplicate, fetch_blocks
+)
+from shared_code.exact_keys import (
+    exact_keys, normalize_phone, registrable_domain, normalize_email, address_hash
+)
+from shared_code.phonetic import soundex, blocking_keys
+from shared_code.geo_grid import GeoGridIndex, coordinates
+from shared_code.dedup_profile import DedupProfiler
+from shared_code.minhash import MinHashIndex
+from shared_code.sqlite_replica import ServicesReplica
+from shared_code.decision_cache import DecisionCache
+from shared_code.cascade import SimilarityCascade
+from shared_code.candidate_index import CandidateIndex
+from shared_code.membership import ValueHashSet, hash_values
+from shared_code.parallel_dedup import SharedCandidateStore, find_service_duplicates_parallel
+from shared_code.base_scraper import BaseScraper
+
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def example_services():
+    return [
+        {'name': 'ST FERIOLE ISLAND PARK', 'zip': '53821', 'city': 'PR DU CHIEN', 'state': 'WI'},
+        {'name': 'OREGON FOOD BANK INC', 'zip': '97211', 'city': 'PORTLAND', 'state': 'OR'},
+        {'name': 'FIRST DEFENSE LEGAL AID', 'zip': '60610', 'city': 'CHICAGO', 'state': 'IL'},
+        {'name': 'LEGAL AID SOCIETY', 'zip': '60610', 'city': 'CHICAGO', 'state': 'IL'},
+    ]
+
+
+@pytest.fixture
+def services_client(mock_mongo_client, example_services):
+    insert_services(example_services, mock_mongo_client.shelter, 'services')
+    return mock_mongo_client.shelter
+
+
+class MockScraper(BaseScraper):
+
+    def __init__(self, df, **kwargs):
+        super().__init__(
+            source='mock', data_url='', data_page_url='', data_format='DF',
+            extract_usecols=None, drop_duplicates_columns=['name', 'zip'],
+            rename_columns={}, service_summary='mock',
+            check_collection='services', dump_collection='tmpMock',
+            dupe_collection='tmpMockDuplicates',
+            data_source_collection_name='mock', collection_dupe_field='name',
+            **kwargs
+        )
+        self._df = df
+
+    def grab_data(self, df=None) -> pd.DataFrame:
+        return super().grab_data(self._df.copy())
+
+
+@pytest.fixture
+def incoming_df():
+    return pd.DataFrame([
+        {'name': 'ST FERIOLE ISLAND PARKS', 'zip': '53821'},
+        {'name': 'OREGON FOOD BANK INC.', 'zip': '97211'},
+        {'name': 'FIRST DEFENSE LEGAL AID', 'zip': '10001'},
+        {'name': 'BRAND NEW SHELTER', 'zip': '60610'},
+    ])
+
+
+def test_ngram_index_locates_duplicate(services_client):
+    index = NgramIndex.from_collection(services_client, 'services')
+    assert len(index) == 4
+    dc = locate_potential_duplicate(
+        'SAINT FERIOLE ISLAND PARK', '53821', services_client, 'services', index
+    )
+    assert dc == 'ST FERIOLE ISLAND PARK'
+
+
+def test_ngram_index_is_partitioned_by_zip(services_client):
+    index = NgramIndex.from_collection(services_client, 'services')
+    assert index.locate_potential_duplicate('FIRST DEFENSE LEGAL AID', '10001') is False
+    assert index.locate_potential_duplicate('FIRST DEFENSE LEGAL AID', 60610) == \
+        'FIRST DEFENSE LEGAL AID'
+
+
+def test_ngram_index_ranks_by_shared_terms(services_client):
+    index = NgramIndex.from_collection(services_client, 'services')
+    names = [name for _, name, _ in index.candidates('LEGAL AID SOCIETY', '60610')]
+    assert names == ['LEGAL AID SOCIETY', 'FIRST DEFENSE LEGAL AID']
+
+
+def test_build_dedup_index_rejects_unknown_kind(services_client):
+    assert build_dedup_index(None, services_client, 'services') is None
+    with pytest.raises(ValueError):
+        build_dedup_index('bogus', services_client, 'services')
+    # cross-source checks go through check_cross_source_duplicates only
+    with pytest.raises(ValueError):
+        build_dedup_index('cross-source', services_client, 'services')
+
+
+def test_find_service_duplicates_with_index(services_client, incoming_df):
+    index = build_dedup_index('ngram', services_client, 'services')
+    assert find_service_duplicates(incoming_df, services_client, 'services', index) == [0, 1]
+
+
+def test_main_scraper_with_ngram_index(services_client, incoming_df):
+    MockScraper(incoming_df).main_scraper(services_client, dedup_index='ngram')
+    assert sorted(d['name'] for d in services_client.tmpMockDuplicates.find()) == [
+        'OREGON FOOD BANK INC.', 'ST FERIOLE ISLAND PARKS'
+    ]
+    assert sorted(d['name'] for d in services_client.tmpMock.find()) == [
+        'BRAND NEW SHELTER', 'FIRST DEFENSE LEGAL AID'
+    ]
+
+
+def test_minhash_index_locates_duplicate(services_client):
+    index = MinHashIndex.from_collection(services_client, 'services')
+    assert len(index) == 4
+    assert index.locate_potential_duplicate('OREGON FOOD BANK INC.', '97211') == \
+        'OREGON FOOD BANK INC'
+    assert index.locate_potential_duplicate('OREGON FOOD BANK INC.', '10001') is False
+
+
+def test_minhash_index_matches_nothing_when_zip_missing(services_client):
+    index = MinHashIndex.from_collection(services_client, 'services')
+    assert index.locate_potential_duplicate('ST FERIOLE ISLAND PARKS', float('nan')) is False
+
+
+def test_minhash_signatures_are_persisted(services_client):
+    MinHashIndex.from_collection(services_client, 'services')
+    stored = services_client.services.find_one({'name': 'LEGAL AID SOCIETY'})
+    assert len(stored['minhash']) == 64
+    assert stored['minhash_name'] == 'legal aid society'
+    index = MinHashIndex.from_collection(services_client, 'services')
+    assert stored['minhash'] == index.signature('LEGAL AID SOCIETY').tolist()
+
+
+def test_sqlite_replica_locates_duplicate(services_client, tmp_path):
+    replica = ServicesReplica.from_collection(
+        services_client, 'services', str(tmp_path / 'replica.sqlite3')
+    )
+    assert len(replica) == 4
+    assert replica.locate_potential_duplicate('ST FERIOLE ISLAND PARKS', '53821') == \
+        'ST FERIOLE ISLAND PARK'
+    assert replica.locate_potential_duplicate('ST FERIOLE ISLAND PARKS', '10001') is False
+
+
+def test_sqlite_replica_syncs_incrementally(services_client, tmp_path):
+    replica = ServicesReplica(str(tmp_path / 'replica.sqlite3'))
+    assert replica.sync(services_client, 'services') == 4
+    assert replica.sync(services_client, 'services') == 0
+    services_client.services.insert_one({'name': 'BRAND NEW SHELTER', 'zip': '60610'})
+    assert replica.sync(services_client, 'services') == 1
+    assert replica.locate_potential_duplicate('NEW SHELTER', '60610') == 'BRAND NEW SHELTER'
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'},
+        {'$set': {'name': 'CHICAGO LEGAL AID SOCIETY', 'updatedAt': datetime.datetime(2021, 1, 1)}}
+    )
+    assert replica.sync(services_client, 'services') == 1
+    assert replica.locate_potential_duplicate('CHICAGO LEGAL', '60610') == 'CHICAGO LEGAL AID SOCIETY'
+    assert replica.sync(services_client, 'services', full=True) == 5
+    assert len(replica) == 5
+
+
+def test_sqlite_replica_full_sync_keeps_other_collections(services_client, tmp_path):
+    path = str(tmp_path / 'replica.sqlite3')
+    insert_services([{'name': 'BRAND NEW SHELTER', 'zip': '60610'}], services_client, 'tmpMock')
+    ServicesReplica(path, 'tmpMock').sync(services_client, 'tmpMock')
+    replica = ServicesReplica.from_collection(services_client, 'services', path)
+    assert replica.locate_potential_duplicate('BRAND NEW SHELTER', '60610') is False
+    replica.sync(services_client, 'services', full=True)
+    replica.close()
+    dump = ServicesReplica(path, 'tmpMock')
+    assert len(dump) == 1
+    assert dump.locate_potential_duplicate('BRAND NEW SHELTER', '60610') == 'BRAND NEW SHELTER'
+
+
+def test_zip_grouped_candidates_prefetches_in_chunks(services_client, incoming_df):
+    index = ZipGroupedCandidates(services_client, 'services', chunk_size=2)
+    index.prefetch(incoming_df['zip'].unique())
+    assert len(index) == 4
+    assert [name for name, _ in index.candidates('LEGAL AID SOCIETY', '60610')] == [
+        'LEGAL AID SOCIETY', 'FIRST DEFENSE LEGAL AID'
+    ]
+    assert index.locate_potential_duplicate('FIRST DEFENSE LEGAL AID', '10001') is False
+
+
+def test_main_scraper_with_zip_grouped_candidates(services_client, incoming_df):
+    MockScraper(incoming_df).main_scraper(services_client, dedup_index='zip')
+    assert sorted(d['name'] for d in services_client.tmpMockDuplicates.find()) == [
+        'OREGON FOOD BANK INC.', 'ST FERIOLE ISLAND PARKS'
+    ]
+
+
+def test_make_qgrams_is_compact():
+    qgrams = make_qgrams('Friends of  Lake Hope')
+    assert qgrams == sorted(set(qgrams))
+    assert qgrams == make_qgrams('FRIENDS OF LAKE HOPE')
+    assert len(qgrams) <= len('FRIENDS OF LAKE HOPE') - 2
+
+
+def test_refresh_qgrams_only_touches_missing_or_renamed(services_client):
+    assert refresh_qgrams(services_client, 'services') == 4
+    assert refresh_qgrams(services_client, 'services') == 0
+    assert 'zip_1_qgrams_1' in services_client.services.index_information()
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'name': 'CHICAGO LEGAL AID'}}
+    )
+    assert refresh_qgrams(services_client, 'services') == 1
+    stored = services_client.services.find_one({'name': 'CHICAGO LEGAL AID'})
+    assert stored['qgrams'] == make_qgrams('CHICAGO LEGAL AID')
+
+
+def test_qgram_index_locates_duplicate(services_client):
+    index = QgramIndex.from_collection(services_client, 'services')
+    assert index.locate_potential_duplicate('ST FERIOLE ISLAND PARKS', '53821') == \
+        'ST FERIOLE ISLAND PARK'
+    assert index.locate_potential_duplicate('LEGAL AID SOCIETY', '60610') == 'LEGAL AID SOCIETY'
+    assert index.locate_potential_duplicate('LEGAL AID SOCIETY', '10001') is False
+
+
+def test_refresh_blocking_keys_follows_renames(services_client):
+    assert refresh_blocking_keys(services_client, 'services') == 4
+    assert refresh_blocking_keys(services_client, 'services') == 0
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'name': 'CHICAGO LEGAL AID'}}
+    )
+    assert refresh_blocking_keys(services_client, 'services') == 1
+    stored = services_client.services.find_one({'name': 'CHICAGO LEGAL AID'})
+    assert stored['blocking_keys'] == blocking_keys('CHICAGO LEGAL AID')
+
+
+def test_refresh_ngrams_is_incremental(services_client):
+    assert refresh_ngrams(services_client, 'services') == 4
+    assert refresh_ngrams(services_client, 'services') == 0
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'name': 'CHICAGO LEGAL AID SOCIETY'}}
+    )
+    assert refresh_ngrams(services_client, 'services') == 1
+    stored = services_client.services.find_one({'name': 'CHICAGO LEGAL AID SOCIETY'})
+    assert stored['ngrams'] == ' '.join(make_ngrams('CHICAGO LEGAL AID SOCIETY'))
+    # normalized names are refreshed in the same pass
+    assert stored['normalized_name'] == 'chicago legal aid society'
+    assert 'zip_1_normalized_name_1' in services_client.services.index_information()
+    assert refresh_normalized_names(services_client, 'services') == 0
+
+
+def test_refresh_ngrams_resumes_from_checkpoint(services_client):
+    ids = sorted(d['_id'] for d in services_client.services.find())
+    services_client['refresh-checkpoints'].insert_one(
+        {'collection': 'services', 'field': 'ngrams', 'last_id': ids[1]}
+    )
+    assert refresh_ngrams(services_client, 'services') == 2
+    assert services_client['refresh-checkpoints'].count_documents({}) == 0
+    assert refresh_ngrams(services_client, 'services') == 2
+
+
+def test_insert_services_with_enrich_hook(mock_mongo_client):
+    records = [{'name': 'Saint Feriole Island Park', 'zip': '53821'}, {'zip': '97211'}]
+    insert_services(records, mock_mongo_client.shelter, 'services', enrich_services)
+    stored = mock_mongo_client.shelter.services.find_one({'zip': '53821'})
+    assert stored['normalized_name'] == 'saint feriole island park'
+    assert stored['qgrams'] == make_qgrams('Saint Feriole Island Park')
+    assert stored['blocking_keys'] == blocking_keys('Saint Feriole Island Park')
+    assert stored['minhash'] == MinHashIndex().signature('Saint Feriole Island Park').tolist()
+    assert 'ngrams' not in mock_mongo_client.shelter.services.find_one({'zip': '97211'})
+    assert refresh_ngrams(mock_mongo_client.shelter, 'services') == 0
+
+
+def test_decision_cache_reuses_decisions(services_client, incoming_df):
+    index = build_dedup_index('ngram', services_client, 'services')
+    cache = DecisionCache.load(services_client, 'services')
+    assert find_service_duplicates(incoming_df, services_client, 'services', index, cache) == [0, 1]
+    cache.flush()
+
+    cache = DecisionCache.load(services_client, 'services')
+    assert len(cache) == 4
+    assert find_service_duplicates(incoming_df, services_client, 'services', None, cache) == [0, 1]
+    assert (cache.hit_count, cache.miss_count) == (4, 0)
+
+
+def test_decision_cache_invalidated_by_services_change(services_client, incoming_df):
+    cache = DecisionCache.load(services_client, 'services')
+    find_service_duplicates(incoming_df, services_client, 'services', NgramIndex(), cache)
+    cache.flush()
+    services_client.services.insert_one({'name': 'BRAND NEW SHELTER', 'zip': '60610'})
+    cache = DecisionCache.load(services_client, 'services')
+    assert len(cache) == 0
+    cache.flush()
+    assert services_client['dedup-decisions'].count_documents({}) == 0
+
+
+def test_decision_cache_is_kept_per_engine(services_client, incoming_df):
+    cache = DecisionCache.load(services_client, 'services', engine='zip')
+    cache.put('BRAND NEW SHELTER', '60610', True, 'LEGAL AID SOCIETY')
+    cache.flush()
+    assert len(DecisionCache.load(services_client, 'services', engine='ngram')) == 0
+    assert len(DecisionCache.load(services_client, 'services', engine='zip')) == 1
+    assert 'updatedAt_1' in services_client.services.index_information()
+
+
+def test_decision_cache_evicts_least_recently_used(services_client):
+    cache = DecisionCache.load(services_client, 'services', max_entries=2)
+    for name in ('A SHELTER', 'B SHELTER', 'C SHELTER'):
+        cache.put(name, '60610', False)
+        cache.flush()
+    names = sorted(d['name'] for d in services_client['dedup-decisions'].find())
+    assert names == ['b shelter', 'c shelter']
+
+
+def test_shared_candidate_store(services_client):
+    store = SharedCandidateStore.from_collection(services_client, 'services')
+    try:
+        assert len(store) == 4
+        assert store.zip_group('60610') == ['FIRST DEFENSE LEGAL AID', 'LEGAL AID SOCIETY']
+        assert store.zip_group('606100') == []
+        assert store.locate_potential_duplicate('LEGAL AID SOCIETY', 60610) == 'LEGAL AID SOCIETY'
+        assert store.locate_potential_duplicate('LEGAL AID SOCIETY', '10001') is False
+    finally:
+        store.close(unlink=True)
+
+
+def test_find_service_duplicates_parallel(services_client, incoming_df):
+    assert find_service_duplicates_parallel(
+        incoming_df, services_client, 'services', workers=2
+    ) == [0, 1]
+
+
+def test_main_scraper_with_workers(services_client, incoming_df):
+    MockScraper(incoming_df).main_scraper(services_client, workers=2, decision_cache=True)
+    assert sorted(d['name'] for d in services_client.tmpMockDuplicates.find()) == [
+        'OREGON FOOD BANK INC.', 'ST FERIOLE ISLAND PARKS'
+    ]
+    assert services_client['dedup-decisions'].count_documents({}) == 4
+
+
+def test_normalize_names_matches_normalize_name():
+    names = ['saint feriole island park', 'Oregon Food Bank inc.', 'st. mary nfp', 'SAINT LOUIS']
+    assert normalize_names(names).tolist() == [normalize_name(n) for n in names]
+
+
+def test_refresh_normalized_names_only_touches_missing_or_renamed(services_client):
+    assert refresh_normalized_names(services_client, 'services', batch_size=3) == 4
+    assert 'zip_1_normalized_name_1' in services_client.services.index_information()
+    services_client.services.insert_one({'name': 'saint feriole park', 'zip': '53821'})
+    assert refresh_normalized_names(services_client, 'services') == 1
+    assert services_client.services.find_one({'zip': '53821', 'name': 'saint feriole park'})[
+        'normalized_name'] == 'feriole park'
+    assert refresh_normalized_names(services_client, 'services') == 0
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'name': 'CHICAGO LEGAL AID'}}
+    )
+    assert refresh_normalized_names(services_client, 'services') == 1
+    df = pd.DataFrame([{'name': 'LEGAL AID SOCIETY', 'zip': '60610'}])
+    assert find_exact_normalized_duplicates(df, services_client, 'services') == []
+
+
+def test_find_exact_normalized_duplicates(services_client):
+    refresh_normalized_names(services_client, 'services')
+    df = pd.DataFrame([
+        {'name': 'legal aid society', 'zip': 60610},
+        {'name': 'Legal Aid Society', 'zip': '10001'},
+        {'name': 'Oregon Food Bank', 'zip': '97211'},
+    ], index=[5, 6, 7])
+    assert find_exact_normalized_duplicates(df, services_client, 'services') == [5]
+
+
+def test_find_exact_normalized_duplicates_skips_empty_names(services_client):
+    insert_services([{'name': '', 'zip': '60610'}], services_client, 'services')
+    refresh_normalized_names(services_client, 'services')
+    df = pd.DataFrame([{'name': ' inc', 'zip': '60610'}, {'name': '', 'zip': '60610'}])
+    assert find_exact_normalized_duplicates(df, services_client, 'services') == []
+
+
+def test_check_service_duplicates_short_circuits_exact_matches(services_client, incoming_df):
+    df = pd.concat(
+        [incoming_df, pd.DataFrame([{'name': 'legal aid society', 'zip': '60610'}])],
+        ignore_index=True
+    )
+    assert check_service_duplicates(df, services_client, 'services', 'ngram') == [0, 1, 4]
+
+
+def test_similarity_cascade_counts_eliminated_pairs():
+    cascade = SimilarityCascade()
+    candidates = [
+        'feriole island park and marina',
+        'island parks feriole',
+        'feriole island parcs',
+        'saint feriole island park',
+    ]
+    assert cascade.best_match('feriole island park', candidates) == 'saint feriole island park'
+    assert cascade.stats == {
+        'pairs': 4, 'length_ratio': 1, 'token_jaccard': 0, 'edit_distance': 2, 'accepted': 1
+    }
+    assert cascade.best_match('a b c d e f g h i j k', ['l m n o p q r s t u v']) is None
+    assert cascade.stats['token_jaccard'] == 1
+
+
+def test_similarity_cascade_agrees_with_bounded_distance():
+    cascade = SimilarityCascade()
+    names = ['legal aid society', 'legal aidsociety', 'legal aid  society', 'legal aid societies',
+             'the legal aid society', 'legal aid soc', 'lega aid society', 'leg al aid society']
+    for a in names:
+        for b in names:
+            assert cascade.similarity(a, b) == bounded_distance(a, b)
+
+
+def test_find_intra_batch_duplicates():
+    df = pd.DataFrame([
+        {'name': 'FRIENDS OF LAKE HOPE', 'zip': '45601'},
+        {'name': 'LEGAL AID SOCIETY', 'zip': '60610'},
+        {'name': 'FRIENDS OF LAKE HOPES', 'zip': '45601'},
+        {'name': 'FRIENDS OF LAKE HOPE', 'zip': '10001'},
+        {'name': 'XLEGAL AID SOCIETY', 'zip': '60610'},
+        {'name': 'FRIENDS OF LAKE HOPE', 'zip': '45601'},
+    ], index=[10, 11, 12, 13, 14, 15])
+    assert find_intra_batch_duplicates(df) == [12, 14, 15]
+    assert find_intra_batch_duplicates(df, window=1) == []
+
+
+def test_find_intra_batch_duplicates_blocks_rows_without_zip():
+    df = pd.DataFrame([
+        {'name': 'LEGAL AID SOCIETY', 'city': 'CHICAGO', 'state': 'IL'},
+        {'name': 'LEGAL AID SOCIETY', 'city': 'PORTLAND', 'state': 'OR'},
+        {'name': 'LEGAL AID SOCIETY', 'city': 'Chicago', 'state': 'IL'},
+        {'name': 'LEGAL AID SOCIETY'},
+        {'name': 'LEGAL AID SOCIETY'},
+    ])
+    assert find_intra_batch_duplicates(df) == [2]
+
+
+def test_main_scraper_moves_intra_batch_duplicates(services_client, incoming_df):
+    df = pd.concat(
+        [incoming_df, pd.DataFrame([{'name': 'BRAND NEW SHELTERS', 'zip': '60610'}])],
+        ignore_index=True
+    )
+    MockScraper(df).main_scraper(services_client, dedup_index='ngram', intra_batch=True)
+    assert sorted(d['name'] for d in services_client.tmpMockDuplicates.find()) == [
+        'BRAND NEW SHELTERS', 'OREGON FOOD BANK INC.', 'ST FERIOLE ISLAND PARKS'
+    ]
+    assert sorted(d['name'] for d in services_client.tmpMock.find()) == [
+        'BRAND NEW SHELTER', 'FIRST DEFENSE LEGAL AID'
+    ]
+
+
+@pytest.fixture
+def cross_source_client(services_client):
+    insert_services([{'name': 'BRAND NEW SHELTER', 'zip': '60610'}], services_client, 'tmpOther')
+    insert_services([{'name': 'BRAND NEW SHELTER', 'zip': '60610'}], services_client, 'tmpOtherDuplicates')
+    insert_services([{'name': 'FIRST DEFENSE LEGAL AID', 'zip': '10001'}], services_client, 'tmpMock')
+    return services_client
+
+
+def test_dump_collections(cross_source_client):
+    assert dump_collections(cross_source_client) == ['tmpMock', 'tmpOther']
+    assert dump_collections(cross_source_client, exclude=['tmpMock']) == ['tmpOther']
+
+
+def test_find_cross_source_duplicates(cross_source_client, incoming_df):
+    index = CrossSourceIndex.from_collections(cross_source_client, ['services', 'tmpOther'])
+    assert len(index) == 5
+    assert find_cross_source_duplicates(incoming_df, index) == {
+        0: 'services', 1: 'services', 3: 'tmpOther'
+    }
+    assert index.locate_potential_duplicate('BRAND NEW SHELTER', '60610') == 'BRAND NEW SHELTER'
+
+
+def test_validate_dedup_options():
+    validate_dedup_options('ngram', decision_cache=True, explain=True, key_match=True)
+    validate_dedup_options(workers=2, decision_cache=True)
+    validate_dedup_options(top_k=5, cross_source=False)
+    with pytest.raises(ValueError, match='cross_source cannot be combined with dedup_index'):
+        validate_dedup_options('ngram', cross_source=True)
+    with pytest.raises(ValueError, match='workers cannot be combined with top_k, explain'):
+        validate_dedup_options(workers=2, top_k=5, explain=True)
+    with pytest.raises(ValueError, match='top_k'):
+        validate_dedup_options('qgram', top_k=5)
+
+
+def test_main_scraper_rejects_ignored_options(cross_source_client, incoming_df):
+    with pytest.raises(ValueError):
+        MockScraper(incoming_df).main_scraper(cross_source_client, cross_source=True, workers=2)
+    assert cross_source_client.tmpMockDuplicates.count_documents({}) == 0
+
+
+def test_main_scraper_with_cross_source(cross_source_client, incoming_df):
+    MockScraper(incoming_df).main_scraper(cross_source_client, cross_source=True)
+    duplicates = {
+        d['name']: d.get('duplicate_collection')
+        for d in cross_source_client.tmpMockDuplicates.find()
+    }
+    # the scraper's own dump collection is purged of exact duplicates, not fuzzy-matched
+    assert duplicates == {
+        'FIRST DEFENSE LEGAL AID': None,
+        'ST FERIOLE ISLAND PARKS': 'services',
+        'OREGON FOOD BANK INC.': 'services',
+        'BRAND NEW SHELTER': 'tmpOther',
+    }
+
+
+def test_soundex():
+    assert soundex('ROBERT') == soundex('RUPERT') == 'R163'
+    assert soundex('ASHCRAFT') == 'A261'
+    assert soundex('TYMCZAK') == 'T522'
+    assert soundex('PANTRY') == soundex('pantrey') == 'P536'
+    assert soundex('211') == ''
+
+
+def test_blocking_keys():
+    assert blocking_keys('saint feriole island park') == [
+        'F640', 'F640 I245 P620', 'I245', 'P620'
+    ]
+    assert blocking_keys('FOOD 4 KIDS') == ['4', '4 F300 K320', 'F300', 'K320']
+    assert blocking_keys('') == []
+
+
+def test_phonetic_index_locates_duplicate(services_client):
+    index = build_dedup_index('phonetic', services_client, 'services')
+    assert isinstance(index, PhoneticIndex)
+    assert 'zip_1_blocking_keys_1' in services_client.services.index_information()
+    # misspelled words keep their Soundex codes
+    assert index.locate_potential_duplicate('LEGEL AYD SOCIETY', '60610') == 'LEGAL AID SOCIETY'
+    assert index.locate_potential_duplicate('LEGAL AID SOCIETY', '10001') is False
+
+
+@pytest.fixture
+def geo_client(mock_mongo_client):
+    insert_services([
+        {'name': 'MANHATTAN FOOD PANTRY', 'zip': '10001', 'lat': 40.7506, 'lon': -73.9972},
+        {'name': 'HOBOKEN SHELTER', 'zip': '07030', 'lat': 40.7440, 'lon': -74.0324},
+        {'name': 'BRONX FOOD PANTRY', 'zip': '10451', 'lat': 40.8200, 'lon': -73.9230},
+        {'name': 'LEGAL AID SOCIETY', 'zip': '60610'},
+    ], mock_mongo_client.shelter, 'services')
+    return mock_mongo_client.shelter
+
+
+def test_coordinates():
+    assert coordinates({'lat': '40.75', 'lon': -73.99}) == (40.75, -73.99)
+    assert coordinates({'latitude': 40.75, 'longitude': -73.99}) == (40.75, -73.99)
+    assert coordinates({'lat': float('nan'), 'lon': -73.99}) is None
+    assert coordinates({'lat': 140, 'lon': -73.99}) is None
+    assert coordinates({'zip': '10001'}) is None
+
+
+def test_geo_grid_index_searches_neighbouring_cells(geo_client):
+    index = GeoGridIndex.from_collection(geo_client, 'services', radius_km=1.0, cell_km=0.5)
+    assert len(index) == 4
+    # across the zip boundary, a few cells away
+    assert index.locate_nearby_duplicate('MANHATTAN FOOD PANTRY', 40.7550, -73.9950) == (
+        'MANHATTAN FOOD PANTRY'
+    )
+    assert index.locate_nearby_duplicate('BRONX FOOD PANTRY', 40.7506, -73.9972) == (
+        'MANHATTAN FOOD PANTRY'
+    )
+    assert index.locate_nearby_duplicate('MANHATTAN FOOD PANTRY', 40.6000, -73.9972) is False
+    assert index.locate_potential_duplicate('LEGAL AID SOCIETY', '60610') == 'LEGAL AID SOCIETY'
+
+
+def test_find_service_duplicates_with_geo_index(geo_client):
+    df = pd.DataFrame([
+        {'name': 'MANHATTAN FOOD PANTRY', 'zip': '10018', 'lat': 40.7530, 'lon': -73.9960},
+        {'name': 'MANHATTAN FOOD PANTRY', 'zip': '10001', 'lat': 40.7000, 'lon': -73.9000},
+        {'name': 'LEGAL AID SOCIETY', 'zip': '60610', 'lat': None, 'lon': None},
+        {'name': 'LEGAL AID SOCIETY', 'zip': '60610', 'lat': 41.9000, 'lon': -87.6300},
+        {'name': 'MANHATTAN FOOD PANTRY', 'zip': '10002', 'lat': 40.7000, 'lon': -73.9000},
+    ])
+    index = build_dedup_index('geo', geo_client, 'services')
+    # the same zip matches too, whether or not the service has coordinates
+    assert find_service_duplicates(df, geo_client, 'services', index) == [0, 1, 2, 3]
+
+
+def test_find_service_duplicates_with_profiler(services_client, incoming_df):
+    profiler = DedupProfiler()
+    index = build_dedup_index('ngram', services_client, 'services')
+    assert find_service_duplicates(
+        incoming_df, services_client, 'services', index, profiler=profiler
+    ) == [0, 1]
+    assert [(e['row'], e['stage'], e['duplicate']) for e in profiler.rows] == [
+        (0, 'fuzzy', True), (1, 'fuzzy', True), (2, 'fuzzy', False), (3, 'fuzzy', False)
+    ]
+    assert profiler.rows[0]['match'] == 'ST FERIOLE ISLAND PARK'
+    assert [e['candidates'] for e in profiler.rows] == [1, 1, 0, 2]
+    assert [e['comparisons'] for e in profiler.rows] == [1, 1, 0, 1]
+    summary = profiler.summary()
+    assert summary['rows'] == 4 and summary['duplicates'] == 2
+    assert dict(summary['candidates'])['2-5'] == 1
+
+
+def test_profiler_counts_candidates_of_the_single_lookup(services_client, incoming_df):
+    index = build_dedup_index('zip', services_client, 'services')
+    calls = []
+    candidates = index.candidates
+    index.candidates = lambda name, zipcode: calls.append(name) or candidates(name, zipcode)
+    profiler = DedupProfiler()
+    find_service_duplicates(incoming_df, services_client, 'services', index, profiler=profiler)
+    assert len(calls) == len(incoming_df)
+    assert [e['candidates'] for e in profiler.rows] == [1, 1, 0, 2]
+
+
+def test_dedup_indexes_share_the_candidate_lookup(services_client):
+    assert all(issubclass(index_class, CandidateIndex) for index_class in DEDUP_INDEXES.values())
+    index = build_dedup_index('qgram', services_client, 'services')
+    assert index.lookup('LEGAL AID SOCIETY', '60610') == ('LEGAL AID SOCIETY', 2)
+    with pytest.raises(NotImplementedError):
+        CandidateIndex().lookup('LEGAL AID SOCIETY', '60610')
+
+
+def test_profiler_records_the_matched_exact_key():
+    profiler = DedupProfiler()
+    profiler.record_exact(3, 'LEGAL AID SOC', '60610', 'LEGAL AID SOCIETY', 'phone:+13125550100')
+    profiler.record_exact(4, 'legal aid society', '60610')
+    assert [(e['stage'], e['match'], e['key']) for e in profiler.rows] == [
+        ('exact_key', 'LEGAL AID SOCIETY', 'phone:+13125550100'),
+        ('exact', 'legal aid society', None),
+    ]
+
+
+def test_main_scraper_explain_writes_trace(services_client, incoming_df, tmp_path):
+    df = pd.concat(
+        [incoming_df, pd.DataFrame([{'name': 'legal aid society', 'zip': '60610'}])],
+        ignore_index=True
+    )
+    trace = tmp_path / 'trace.jsonl'
+    MockScraper(df).main_scraper(services_client, dedup_index='zip', explain=str(trace))
+    rows = [json.loads(line) for line in trace.read_text().splitlines()]
+    assert sorted((r['row'], r['stage'], r['duplicate']) for r in rows) == [
+        (0, 'fuzzy', True), (1, 'fuzzy', True), (2, 'fuzzy', False),
+        (3, 'fuzzy', False), (4, 'exact', True)
+    ]
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resolve_service_matches(services_client, incoming_df, workers):
+    decisions = resolve_service_matches(incoming_df, services_client, 'services', workers)
+    assert decisions['duplicate'].tolist() == [True, True, False, False]
+    assert decisions['match'].tolist() == [
+        'ST FERIOLE ISLAND PARK', 'OREGON FOOD BANK INC', None, 'LEGAL AID SOCIETY'
+    ]
+    park = services_client.services.find_one({'name': 'ST FERIOLE ISLAND PARK'})
+    assert decisions.loc[0, 'match_id'] == str(park['_id'])
+    assert decisions.loc[2, 'match_id'] is None
+    assert decisions.loc[0, 'score'] == pytest.approx(1 - 1 / 22)
+
+
+def test_exact_key_normalizers():
+    assert normalize_phone('(503) 555-1234 ext. 5') == '+15035551234'
+    assert normalize_phone('1-503-555-1234') == '+15035551234'
+    assert normalize_phone('+44 20 7946 0958') == '+442079460958'
+    assert normalize_phone('555-1234') is None
+    assert registrable_domain('https://www.OregonFoodBank.org/get-help') == 'oregonfoodbank.org'
+    assert registrable_domain('foodbank.bc.ca') == 'foodbank.bc.ca'
+    assert registrable_domain('https://www.facebook.com/somepantry') is None
+    assert normalize_email(' Info@OFB.org ') == 'info@ofb.org'
+    assert normalize_email('not an email') is None
+    assert address_hash('123 North Main Street', 'Portland', 'OR', '97211') == (
+        address_hash('123 N Main St', 'PORTLAND', 'or', '97211-1234')
+    )
+    assert address_hash('123 N Main St', 'Portland', 'OR', float('nan')) is None
+    assert exact_keys({'phone': '503.555.1234', 'email': 'a@b.org', 'zip': '97211'}) == [
+        'email:a@b.org', 'phone:+15035551234'
+    ]
+
+
+def test_exact_key_duplicates_short_circuit(services_client, incoming_df):
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'},
+        {'$set': {'phone': '(312) 555-0100', 'address1': '100 W Randolph St'}}
+    )
+    assert refresh_exact_keys(services_client, 'services') == 4
+    assert refresh_exact_keys(services_client, 'services') == 0
+    assert 'zip_1_exact_keys_1' in services_client.services.index_information()
+    df = pd.concat([incoming_df, pd.DataFrame([
+        {'name': 'LEGAL AID SOCIETY CHI', 'zip': '60610', 'phone': '312-555-0100'},
+        {'name': 'LEGAL AID SOCIETY IL', 'zip': '60610', 'address1': '100 West Randolph Street',
+         'city': 'Chicago', 'state': 'IL'},
+        {'name': 'LEGAL AID SOCIETY CHI', 'zip': '10001', 'phone': '312-555-0100'},
+    ])], ignore_index=True)
+    assert find_exact_key_duplicates(df, services_client, 'services') == {
+        4: ('phone:+13125550100', 'LEGAL AID SOCIETY'),
+        5: (f'address:{address_hash("100 W Randolph St", "CHICAGO", "IL", "60610")}',
+            'LEGAL AID SOCIETY'),
+    }
+    assert check_service_duplicates(df, services_client, 'services', 'ngram') == [0, 1]
+    assert check_service_duplicates(
+        df, services_client, 'services', 'ngram', key_match=True
+    ) == [0, 1, 4, 5]
+
+
+def test_exact_key_duplicates_need_a_similar_name(mock_mongo_client):
+    client = mock_mongo_client.shelter
+    insert_services([{
+        'name': 'CATHOLIC CHARITIES FOOD PANTRY', 'zip': '97211', 'phone': '503-555-0100',
+        'website': 'https://www.portlandoregon.gov/pantry', 'address1': '123 N Main St',
+        'city': 'Portland', 'state': 'OR',
+    }], client, 'services')
+    refresh_exact_keys(client, 'services')
+    df = pd.DataFrame([
+        {'name': 'WOMENS SHELTER PROGRAM', 'zip': '97211', 'phone': '(503) 555-0100'},
+        {'name': 'PARKS AND RECREATION YOUTH', 'zip': '97211',
+         'website': 'portlandoregon.gov/parks'},
+        {'name': 'HOUSING CLINIC', 'zip': '97211', 'address1': '123 North Main Street',
+         'city': 'Portland', 'state': 'OR'},
+        {'name': 'CATHOLIC CHARITIES PANTRY', 'zip': '97211', 'phone': '503.555.0100'},
+    ])
+    assert list(find_exact_key_duplicates(df, client, 'services')) == [3]
+
+
+def test_refresh_exact_keys_follows_changes(services_client):
+    refresh_exact_keys(services_client, 'services')
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'phone': '(312) 555-0100'}}
+    )
+    assert refresh_exact_keys(services_client, 'services') == 1
+    assert services_client.services.find_one({'name': 'LEGAL AID SOCIETY'})['exact_keys'] == [
+        'phone:+13125550100'
+    ]
+
+
+def test_blocking_strategies():
+    assert CityStateBlocking().value(
+        {'name': 'Feriole Park', 'city': ' Pr du  Chien', 'state': 'wi'}
+    ) == 'PR DU CHIEN|WI|FE'
+    assert CityStateBlocking().value({'name': 'PARK', 'city': float('nan'), 'state': 'WI'}) is None
+    with pytest.raises(TypeError):
+        BlockingStrategy()
+    assert StateNamePrefixBlocking().value({'name': 'saint feriole park', 'state': 'BC'}) == 'BC|FERI'
+    assert StateNamePrefixBlocking().value({'name': 'LEGAL AID', 'state': None}) is None
+
+
+def test_locate_blocked_duplicate(services_client):
+    assert refresh_blocking_fields(services_client, 'services') == 4
+    indexes = services_client.services.index_information()
+    assert {'zip_1', 'city_state_1', 'state_name_prefix_1'} <= set(indexes)
+    assert refresh_blocking_fields(services_client, 'services') == 0
+    row = {'name': 'LEGAL AID SOCIETY', 'zip': float('nan'), 'city': 'Chicago', 'state': 'IL'}
+    assert locate_blocked_duplicate(row, services_client, 'services') == (
+        'LEGAL AID SOCIETY', 'city_state'
+    )
+    blocks = fetch_blocks([row], services_client, 'services')
+    assert blocks == {('city_state', 'CHICAGO|IL|LE'): ['LEGAL AID SOCIETY']}
+    assert locate_blocked_duplicate(row, None, 'services', blocks=blocks) == (
+        'LEGAL AID SOCIETY', 'city_state'
+    )
+    row = {'name': 'OREGON FOOD BANK INC', 'state': 'OR'}
+    assert locate_blocked_duplicate(row, services_client, 'services') == (
+        'OREGON FOOD BANK INC', 'state_name_prefix'
+    )
+    assert locate_blocked_duplicate({'name': 'NOWHERE'}, services_client, 'services') == (False, None)
+
+
+def test_refresh_blocking_fields_follows_changes(services_client):
+    refresh_blocking_fields(services_client, 'services')
+    services_client.services.update_one(
+        {'name': 'LEGAL AID SOCIETY'}, {'$set': {'city': 'EVANSTON'}}
+    )
+    assert refresh_blocking_fields(services_client, 'services') == 1
+    assert services_client.services.find_one({'name': 'LEGAL AID SOCIETY'})['city_state'] == (
+        'EVANSTON|IL|LE'
+    )
+
+
+def test_check_service_duplicates_without_zips(services_client):
+    df = pd.DataFrame([
+        {'name': 'LEGAL AID SOCIETY', 'city': 'CHICAGO', 'state': 'IL'},
+        {'name': 'OREGON FOOD BANK INC', 'city': None, 'state': 'OR'},
+        {'name': 'LEGAL AID SOCIETY', 'city': 'PORTLAND', 'state': 'OR'},
+    ])
+    assert check_service_duplicates(df, services_client, 'services', 'ngram') == [0, 1]
+
+
+def test_minhash_rows_without_zip_use_their_block(services_client):
+    df = pd.DataFrame([
+        {'name': 'OREGON FOOD BANK INC', 'zip': float('nan'), 'city': 'PORTLAND', 'state': 'OR'},
+        {'name': 'OREGON FOOD BANK INC', 'zip': float('nan'), 'city': 'PORTLAND', 'state': 'ME'},
+    ])
+    assert check_service_duplicates(df, services_client, 'services', 'minhash') == [0]
+    assert check_service_duplicates(df, services_client, 'services', 'ngram') == [0]
+
+
+def test_find_existing_values(services_client):
+    names = ['LEGAL AID SOCIETY', 'BRAND NEW SHELTER', None, float('nan'), 'LEGAL AID SOCIETY']
+    assert find_existing_values(services_client, 'services', 'name', names, chunk_size=1) == {
+        'LEGAL AID SOCIETY'
+    }
+    assert 'name_1' in services_client.services.index_information()
+
+
+def test_purge_collection_duplicates(services_client, incoming_df):
+    insert_services([
+        {'name': 'BRAND NEW SHELTER', 'zip': '60610'},
+        {'name': 'FIRST DEFENSE LEGAL AID', 'zip': '60610'},
+    ], services_client, 'tmpMock')
+    scraper = MockScraper(incoming_df)
+    df = scraper.purge_collection_duplicates(incoming_df, services_client)
+    assert df['name'].tolist() == ['ST FERIOLE ISLAND PARKS', 'OREGON FOOD BANK INC.']
+    assert sorted(d['name'] for d in services_client.tmpMockDuplicates.find()) == [
+        'BRAND NEW SHELTER', 'FIRST DEFENSE LEGAL AID'
+    ]
+
+
+def test_hash_values_match_mongo_equality():
+    assert list(hash_values([123, 123.0, '123'])) == [hash_values([123])[0]] * 3
+    assert len(hash_values([None, float('nan'), 'A'])) == 1
+
+
+def test_value_hash_set_is_persisted_and_updated(services_client):
+    values = ValueHashSet.load(services_client, 'services', 'name')
+    assert len(values) == 4
+    assert list(values.might_contain(['LEGAL AID SOCIETY', 'BRAND NEW SHELTER', None])) == [
+        True, False, False
+    ]
+    insert_services([{'name': 'BRAND NEW SHELTER'}], services_client, 'services')
+    values.add(['BRAND NEW SHELTER'])
+    values.save(services_client)
+    assert services_client['data-sources-membership'].count_documents({}) == 2
+    reloaded = ValueHashSet.load(services_client, 'services', 'name')
+    assert len(reloaded) == 5
+    assert reloaded.might_contain(['BRAND NEW SHELTER'])[0]
+
+
+def test_value_hash_set_rebuilt_when_stale(services_client):
+    ValueHashSet.load(services_client, 'services', 'name')
+    insert_services([{'name': 'BRAND NEW SHELTER'}], services_client, 'services')
+    values = ValueHashSet.load(services_client, 'services', 'name')
+    assert values.might_contain(['BRAND NEW SHELTER'])[0]
+    assert services_client['data-sources-membership'].count_documents({}) == 1
+
+
+def test_main_scraper_with_dupe_prefilter(services_client, incoming_df):
+    insert_services([{'name': 'BRAND NEW SHELTER', 'zip': '60610'}], services_client, 'tmpMock')
+    MockScraper(incoming_df).main_scraper(services_client, dedup_index='ngram', dupe_prefilter=True)
+    assert 'BRAND NEW SHELTER' in [d['name'] for d in services_client.tmpMockDuplicates.find()]
+    values = ValueHashSet.load(services_client, 'tmpMock', 'name')
+    assert list(values.might_contain(['FIRST DEFENSE LEGAL AID', 'UNSEEN'])) == [True, False]